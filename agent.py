@@ -7,45 +7,113 @@
 
 from __future__ import annotations
 
+import atexit
+import base64
 import hashlib
 import json
+import logging
 import os
 import smtplib
 import sqlite3
 import ssl
+import sys
+import threading
 import time
-from email.message import EmailMessage
-from typing import Dict, Iterable, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.header import Header
+from email.utils import formataddr, formatdate, make_msgid, parseaddr
+from functools import lru_cache
+from html import escape
+from importlib.util import find_spec
+from logging.handlers import MemoryHandler
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Union
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Logging: der "agent"-Logger propagiert normal (Flask/gunicorn sehen alles). Nur als
+# eigenständiger Cron-Prozess hängt _setup_script_logging() einen Puffer nach stderr an –
+# ein write pro 64 Zeilen statt pro Zeile, Warnungen/Fehler leeren ihn sofort.
+class _StderrHandler(logging.StreamHandler):
+    """Schreibt immer auf das *aktuelle* sys.stderr (Puffer wird evtl. erst bei Exit geleert)."""
+
+    @property
+    def stream(self):
+        return sys.stderr
+
+    @stream.setter
+    def stream(self, _value):
+        pass
+
+logger = logging.getLogger("agent")
+logger.setLevel(logging.INFO)
+
+def _setup_script_logging() -> None:
+    """Gepufferter stderr-Handler für den Aufruf als Skript – nur, wenn noch keiner da ist."""
+    if logger.handlers or logging.getLogger().handlers:
+        return
+    sink = _StderrHandler()
+    sink.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(MemoryHandler(64, flushLevel=logging.WARNING, target=sink))
+
+def _flush_logs() -> None:
+    for handler in logger.handlers:
+        handler.flush()
 
 # -------------------------------------------------
 # Optionale Integrationen (nicht zwingend vorhanden)
 # -------------------------------------------------
-try:
-    from models import SessionLocal, User
-    from telegram_bot import send_new_item_alert
-    TELEGRAM_AVAILABLE = True
-except Exception:
-    TELEGRAM_AVAILABLE = False
-    print("[agent] Telegram module not available - continuing without Telegram alerts")
+# Nur prüfen, ob die Module da sind – importiert wird erst bei Bedarf (SQLAlchemy &
+# Co. kosten beim Kaltstart spürbar Zeit/RAM, auch wenn kein Telegram-Versand ansteht).
+TELEGRAM_AVAILABLE      = find_spec("models") is not None and find_spec("telegram_bot") is not None
+VISION_AVAILABLE        = find_spec("image_analyzer") is not None
+SMART_FILTERS_AVAILABLE = find_spec("smart_filters") is not None
 
-try:
-    from image_analyzer import check_item_damage  # noqa: F401
-    VISION_AVAILABLE = True
-except Exception:
-    VISION_AVAILABLE = False
+SessionLocal = User = send_new_item_alert = None
+_TG_IMPORT_LOCK = threading.Lock()
+
+def _load_telegram() -> bool:
+    """Importiert models/telegram_bot beim ersten Bedarf; False, wenn das scheitert."""
+    global TELEGRAM_AVAILABLE, SessionLocal, User, send_new_item_alert
+    if not TELEGRAM_AVAILABLE or send_new_item_alert is not None:
+        return TELEGRAM_AVAILABLE
+    with _TG_IMPORT_LOCK:
+        if send_new_item_alert is None:
+            try:
+                from models import SessionLocal, User
+                from telegram_bot import send_new_item_alert
+            except Exception:
+                TELEGRAM_AVAILABLE = False
+                logger.info("[agent] Telegram module not available - continuing without Telegram alerts")
+    return TELEGRAM_AVAILABLE
 
 try:
-    from smart_filters import apply_smart_filters  # noqa: F401
-    SMART_FILTERS_AVAILABLE = True
-except Exception:
-    SMART_FILTERS_AVAILABLE = False
+    import orjson  # schneller JSON-Parser/-Encoder (Rust), optional
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 
 # -----------------------
 # Helper & ENV
 # -----------------------
 _http = requests.Session()
+_http.headers["User-Agent"] = "ebay-agent/1.0"
+# Keep-Alive-Pool groß genug für die parallelen Term-Suchen (siehe EBAY_CONCURRENCY);
+# kurze Wiederholung mit Backoff bei 429/5xx statt eines leeren Alert-Laufs
+_http.mount("https://", HTTPAdapter(
+    pool_connections=16, pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.5,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      respect_retry_after_header=True),
+))
+atexit.register(_http.close)
 
 def as_bool(v: Optional[str], default=False) -> bool:
     if v is None:
@@ -85,17 +153,27 @@ EBAY_MARKETPLACE_ID, EBAY_CURRENCY = MARKETPLACE_BY_GLOBAL.get(
     EBAY_GLOBAL_ID, ("EBAY_DE", "EUR")
 )
 
-# Mail – Postmark-API bevorzugen, mehrere ENV-Alias unterstützt
-POSTMARK_TOKEN = (
-    getenv_any("POSTMARK_API_TOKEN", "POSTMARK_SERVER_TOKEN", "POSTMARK_TOKEN")
-)
-POSTMARK_FROM  = getenv_any("FROM_EMAIL", "EMAIL_FROM", "POSTMARK_FROM")
-EMAIL_PROVIDER = (os.getenv("EMAIL_PROVIDER") or "").lower()
-USE_POSTMARK   = (EMAIL_PROVIDER == "postmark") or (bool(POSTMARK_TOKEN) and bool(POSTMARK_FROM))
+# Mail-Zugangsdaten (Postmark/SMTP) liest get_mail_settings() erst beim ersten Aufruf:
+# app.py importiert dieses Modul, bevor es .env/.env.local lädt
+SMTP_MAX_MSGS_PER_CONN = max(1, int(os.getenv("SMTP_MAX_MSGS_PER_CONN", "100")))
+SMTP_MAX_CONN_AGE      = float(os.getenv("SMTP_MAX_CONN_AGE", "100"))
 
+# Mehrere Alerts desselben Nutzers in EINER Sammelmail pro Lauf (0 = eine Mail pro Alert)
+ALERT_DIGEST               = as_bool(os.getenv("ALERT_DIGEST", "1"))
+# Mehrere Ein-Wort-Begriffe als EINE ODER-Suche schicken (weniger Calls, andere Gewichtung)
+EBAY_COMBINE_TERMS         = as_bool(os.getenv("EBAY_COMBINE_TERMS", "0"))
+EBAY_CONCURRENCY           = max(1, int(os.getenv("EBAY_CONCURRENCY", "8")))
+# Obergrenze für Browse-Calls pro Sekunde über alle Worker (0 = unbegrenzt)
+EBAY_MAX_RPS               = float(os.getenv("EBAY_MAX_RPS", "5"))
 NOTIFY_MAX_ITEMS_PER_MAIL  = int(os.getenv("ALERT_MAX_ITEMS", "12"))
 NOTIFY_MAX_ITEMS_TELEGRAM  = int(os.getenv("TELEGRAM_MAX_ITEMS", "3"))
 DEBUG_LOG                  = as_bool(os.getenv("ALERT_DEBUG", "0"))
+if DEBUG_LOG:
+    logger.setLevel(logging.DEBUG)
+# versendete De-Dup-Einträge nach so vielen Tagen löschen (0 = nie)
+ALERT_SEEN_RETENTION_DAYS  = int(os.getenv("ALERT_SEEN_RETENTION_DAYS", "90"))
+# Suchen ohne jeden Treffer so viele Sekunden nicht wiederholen (0 = aus)
+EBAY_EMPTY_TTL             = int(os.getenv("EBAY_EMPTY_TTL", "600"))
 
 # Optional: Empfänger-Whitelist (Komma/semi-kolon getrennt)
 _PILOT = os.getenv("PILOT_EMAILS", "")
@@ -104,84 +182,209 @@ PILOT_EMAILS = {e.strip().lower() for part in _PILOT.split(",") for e in part.sp
 # -----------------------
 # DB
 # -----------------------
+_CONN: Optional[sqlite3.Connection] = None
+# Verbindung, für die das Schema schon aktuell ist (neue Verbindung → neu prüfen)
+_SCHEMA_READY: Optional[sqlite3.Connection] = None
+_SCHEMA_LOCK = threading.Lock()
+
 def get_db() -> sqlite3.Connection:
+    """Prozessweite SQLite-Verbindung (lazy), damit der Page-Cache über alle Alerts warm bleibt."""
+    global _CONN
+    if _CONN is not None:
+        return _CONN
     dirname = os.path.dirname(DB_FILE)
     if dirname:
         os.makedirs(dirname, exist_ok=True)
-    conn = sqlite3.connect(DB_FILE)
+    # mehr Platz im Statement-Cache: die Hot-Path-SQLs unten werden so nur einmal geparst
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    # wirkt nur auf neue, leere Dateien (und nur vor dem WAL-Wechsel): freie Seiten nach
+    # der GC per incremental_vacuum zurückgeben statt per VACUUM, das app.py aussperren würde
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    # app.py schreibt parallel in dieselbe Datei – auf dessen Lock warten statt "database is locked"
+    conn.execute("PRAGMA busy_timeout=60000")
+    conn.execute("PRAGMA mmap_size=268435456")
+    _CONN = conn
     return conn
 
-def table_exists(conn: sqlite3.Connection, name: str) -> bool:
-    cur = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (name,))
-    return bool(cur.fetchone())
+def _alert_seen_without_rowid(conn: sqlite3.Connection) -> None:
+    """
+    Baut alert_seen als WITHOUT ROWID neu – mit ALLEN vorhandenen Spalten, Indizes und
+    Triggern (init_db.py legt z. B. times_seen/price_* an). Ohne PK geht WITHOUT ROWID
+    nicht; dann bleibt die Tabelle, wie sie ist.
+    """
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name='alert_seen'"
+    ).fetchone()
+    if row is None or "WITHOUT ROWID" in (row[0] or "").upper():
+        return
+    cols = conn.execute("PRAGMA table_info(alert_seen)").fetchall()
+    pk = [c[1] for c in sorted(cols, key=lambda c: c[5]) if c[5] > 0]
+    if not pk:
+        return
+    quote = lambda name: '"' + name.replace('"', '""') + '"'
+    defs = []
+    for _, name, ctype, notnull, default, _ in cols:
+        d = f"{quote(name)} {ctype or ''}".rstrip()
+        if notnull:
+            d += " NOT NULL"
+        if default is not None:
+            d += f" DEFAULT {default}"
+        defs.append(d)
+    defs.append(f"PRIMARY KEY ({', '.join(map(quote, pk))})")
+    extras = [r[0] for r in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name='alert_seen' "
+        "AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+    )]
+    names = ", ".join(quote(c[1]) for c in cols)
+    conn.execute(f"CREATE TABLE alert_seen_v4 ({', '.join(defs)}) WITHOUT ROWID")
+    conn.execute(f"INSERT INTO alert_seen_v4 ({names}) SELECT {names} FROM alert_seen")
+    conn.execute("DROP TABLE alert_seen")
+    conn.execute("ALTER TABLE alert_seen_v4 RENAME TO alert_seen")
+    for sql in extras:
+        conn.execute(sql)
+
+# Schema-Migrationen: (Version, SQL oder Funktion(conn)). Stand steht in PRAGMA user_version,
+# neue Schritte nur hinten anhängen, nie umnummerieren.
+MIGRATIONS: List[Tuple[int, Union[str, Callable[[sqlite3.Connection], None]]]] = [
+    (1, """
+        CREATE TABLE IF NOT EXISTS search_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_email   TEXT NOT NULL,
+            terms_json   TEXT NOT NULL,
+            filters_json TEXT NOT NULL,
+            per_page     INTEGER NOT NULL DEFAULT 20,
+            is_active    INTEGER NOT NULL DEFAULT 1,
+            last_run_ts  INTEGER NOT NULL DEFAULT 0
+        )
+    """),
+    (2, "CREATE INDEX IF NOT EXISTS idx_alerts_active ON search_alerts(is_active)"),
+    (3, """
+        CREATE TABLE IF NOT EXISTS alert_seen (
+            user_email   TEXT    NOT NULL,
+            search_hash  TEXT    NOT NULL,
+            src          TEXT    NOT NULL,
+            item_id      TEXT    NOT NULL,
+            first_seen   INTEGER NOT NULL,
+            last_sent    INTEGER NOT NULL,
+            PRIMARY KEY (user_email, search_hash, src, item_id)
+        )
+    """),
+    # alert_seen als WITHOUT ROWID: der PK ist die Tabelle, kein zweiter B-Baum
+    (4, _alert_seen_without_rowid),
+    # (is_active, user_email) für load_alerts, (search_hash, src) für Aufräum-/Report-Queries
+    # der app.py. ANALYZE füllt sqlite_stat1 für den Planer. idx_alerts_active bleibt –
+    # init_db.py/database.py legen ihn ebenfalls an.
+    (5, """
+        CREATE INDEX IF NOT EXISTS idx_search_alerts_active_email ON search_alerts(is_active, user_email);
+        CREATE INDEX IF NOT EXISTS idx_alert_seen_lookup ON alert_seen(search_hash, src);
+        ANALYZE
+    """),
+    # eBay-OAuth-Token über Prozessgrenzen hinweg (eine Zeile pro Client-ID)
+    (6, """
+        CREATE TABLE IF NOT EXISTS ebay_token (
+            client_id    TEXT PRIMARY KEY,
+            access_token TEXT    NOT NULL,
+            expires_at   INTEGER NOT NULL
+        )
+    """),
+    # kleine Key-Value-Tabelle für Wartungs-Zeitstempel; Index auf last_sent, damit das
+    # Aufräumen alter Einträge keinen Full-Scan braucht. Bewusst ohne Teilbedingung:
+    # alert_seen bekommt nur noch versendete Zeilen (mark_sent), fast alle haben last_sent > 0
+    (7, """
+        CREATE TABLE IF NOT EXISTS kv (
+            k TEXT PRIMARY KEY,
+            v TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_alert_seen_last_sent ON alert_seen(last_sent)
+    """),
+    # 8 entfällt: ein Teilindex über aktive Alerts hätte nur idx_alerts_active bzw.
+    # idx_search_alerts_active_email dupliziert (Lücken in der Nummerierung sind erlaubt)
+    # search_hash am Alert speichern; befüllt load_alerts() beim ersten Lesen (app.py legt
+    # Alerts ohne Hash an, Begriffe/Filter ändern sich danach nicht mehr)
+    (9, """
+        ALTER TABLE search_alerts ADD COLUMN search_hash TEXT;
+        CREATE INDEX IF NOT EXISTS idx_alerts_hash ON search_alerts(search_hash)
+    """),
+]
 
 def init_db_if_needed() -> None:
+    global _SCHEMA_READY
     conn = get_db()
-    cur = conn.cursor()
-    if not table_exists(conn, "search_alerts"):
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS search_alerts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_email   TEXT NOT NULL,
-                terms_json   TEXT NOT NULL,
-                filters_json TEXT NOT NULL,
-                per_page     INTEGER NOT NULL DEFAULT 20,
-                is_active    INTEGER NOT NULL DEFAULT 1,
-                last_run_ts  INTEGER NOT NULL DEFAULT 0
-            )
-        """)
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_alerts_active ON search_alerts(is_active)")
-    if not table_exists(conn, "alert_seen"):
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS alert_seen (
-                user_email   TEXT    NOT NULL,
-                search_hash  TEXT    NOT NULL,
-                src          TEXT    NOT NULL,
-                item_id      TEXT    NOT NULL,
-                first_seen   INTEGER NOT NULL,
-                last_sent    INTEGER NOT NULL,
-                PRIMARY KEY (user_email, search_hash, src, item_id)
-            )
-        """)
-    conn.commit()
-    conn.close()
+    # einmal pro Verbindung geprüft reicht – lange laufende Worker sparen sich das pro Lauf
+    if _SCHEMA_READY is conn:
+        return
+    with _SCHEMA_LOCK:
+        if _SCHEMA_READY is conn:
+            return
+        _migrate(conn)
+        _SCHEMA_READY = conn
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= MIGRATIONS[-1][0]:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        # nach dem Schreib-Lock erneut lesen – ein paralleler Lauf kann schneller gewesen sein
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for ver, sql in MIGRATIONS:
+            if ver > version:
+                if callable(sql):
+                    # Schritte, die das vorhandene Schema erst lesen müssen
+                    sql(conn)
+                else:
+                    # mehrere Statements pro Schritt möglich (executescript würde die Transaktion beenden)
+                    for stmt in sql.split(";"):
+                        if stmt.strip():
+                            conn.execute(stmt)
+                conn.execute(f"PRAGMA user_version = {int(ver)}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 # -----------------------
 # Mail (API-first)
 # -----------------------
-def get_mail_settings() -> Dict[str, object]:
-    """Gibt entweder Postmark- oder SMTP-Einstellungen zurück."""
-    if USE_POSTMARK:
-        return {
+@lru_cache(maxsize=1)
+def get_mail_settings() -> Mapping[str, object]:
+    """
+    Gibt entweder Postmark- oder SMTP-Einstellungen zurück (Postmark bevorzugt, mehrere
+    ENV-Alias unterstützt). Einmal gebaut und schreibgeschützt geteilt; nach Änderungen
+    am Environment (z. B. load_dotenv) get_mail_settings.cache_clear() aufrufen.
+    """
+    postmark_token = getenv_any("POSTMARK_API_TOKEN", "POSTMARK_SERVER_TOKEN", "POSTMARK_TOKEN")
+    postmark_from  = getenv_any("FROM_EMAIL", "EMAIL_FROM", "POSTMARK_FROM")
+    provider       = (os.getenv("EMAIL_PROVIDER") or "").lower()
+    if provider == "postmark" or (postmark_token and postmark_from):
+        return MappingProxyType({
             "provider": "postmark",
-            "api_key": POSTMARK_TOKEN,
-            "from": POSTMARK_FROM,
-        }
-    # SMTP Fallback (nur wenn wirklich konfiguriert)
-    host = getenv_any("SMTP_HOST", "EMAIL_SMTP_HOST")
-    port = int(getenv_any("SMTP_PORT", "EMAIL_SMTP_PORT", default="0") or 0)
+            "api_key": postmark_token,
+            "from": postmark_from,
+        })
+    # SMTP-Fallback (nur wenn wirklich konfiguriert)
     user = getenv_any("SMTP_USER", "EMAIL_USER")
-    pwd  = getenv_any("SMTP_PASS", "EMAIL_PASSWORD")
-    from_addr = getenv_any("SMTP_FROM", "EMAIL_FROM") or user or "alerts@localhost"
-    use_tls = as_bool(os.getenv("SMTP_USE_TLS", "1"))
-    use_ssl = as_bool(os.getenv("SMTP_USE_SSL", "0"))
-    return {
+    return MappingProxyType({
         "provider": "smtp",
-        "host": host,
-        "port": port,
+        "host": getenv_any("SMTP_HOST", "EMAIL_SMTP_HOST"),
+        "port": int(getenv_any("SMTP_PORT", "EMAIL_SMTP_PORT", default="0") or 0),
         "user": user,
-        "password": pwd,
-        "from": from_addr,
-        "use_tls": use_tls,
-        "use_ssl": use_ssl,
-    }
+        "password": getenv_any("SMTP_PASS", "EMAIL_PASSWORD"),
+        "from": getenv_any("SMTP_FROM", "EMAIL_FROM") or user or "alerts@localhost",
+        "use_tls": as_bool(os.getenv("SMTP_USE_TLS", "1")),
+        "use_ssl": as_bool(os.getenv("SMTP_USE_SSL", "0")),
+    })
 
 def send_mail_postmark(api_key: str, from_addr: str, to_addrs: Iterable[str],
                        subject: str, body_html: str) -> bool:
     """Sendet E-Mail via Postmark API"""
     if not api_key or not from_addr or not to_addrs:
-        print("[postmark] Config incomplete")
+        logger.warning("[postmark] Config incomplete")
         return False
 
     url = "https://api.postmarkapp.com/email"
@@ -208,60 +411,244 @@ def send_mail_postmark(api_key: str, from_addr: str, to_addrs: Iterable[str],
         }
 
         try:
-            r = _http.post(url, json=payload, headers=headers, timeout=30)
+            # selbst kodiert (Content-Type steht oben); search_hash bleibt bewusst bei json
+            r = _http.post(url, data=_json_dumps(payload), headers=headers, timeout=30)
             r.raise_for_status()
-            response_data = r.json()
+            response_data = _json_loads(r.content)
             message_id = response_data.get('MessageID', 'unknown')
-            print(f"[postmark] ✓ Sent to {to_addr} (ID: {message_id})")
+            logger.info("[postmark] ✓ Sent to %s (ID: %s)", to_addr, message_id)
             success_count += 1
         except requests.exceptions.HTTPError as e:
-            print(f"[postmark] ✗ HTTP ERROR {e.response.status_code}: {e.response.text}")
+            logger.error("[postmark] ✗ HTTP ERROR %s: %s", e.response.status_code, e.response.text)
         except Exception as e:
-            print(f"[postmark] ✗ ERROR: {e}")
+            logger.error("[postmark] ✗ ERROR: %s", e)
 
     # Erfolg wenn mindestens eine Mail raus ging
     return success_count > 0
 
-def send_mail_smtp(settings: Dict[str, object], to_addrs: Iterable[str],
-                   subject: str, body_html: str) -> bool:
+POSTMARK_BATCH_MAX = 500  # Obergrenze von /email/batch pro Request
+
+def send_mail_postmark_batch(api_key: str, from_addr: str,
+                             messages: List[Tuple[str, str, str]]) -> List[bool]:
+    """
+    Mehrere Mails (to, subject, html) über /email/batch – ein Request je 500 Stück.
+    Liefert pro Nachricht, ob Postmark sie angenommen hat (ErrorCode 0).
+    """
+    if not api_key or not from_addr:
+        logger.warning("[postmark] Config incomplete")
+        return [False] * len(messages)
+
+    url = "https://api.postmarkapp.com/email/batch"
+    headers = {
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+        "X-Postmark-Server-Token": api_key
+    }
+    results: List[bool] = []
+    for i in range(0, len(messages), POSTMARK_BATCH_MAX):
+        chunk = messages[i:i + POSTMARK_BATCH_MAX]
+        payload = [{
+            "From": from_addr,
+            "To": to_addr,
+            "Subject": subject,
+            "HtmlBody": body_html,
+            "MessageStream": "outbound"
+        } for to_addr, subject, body_html in chunk]
+        try:
+            r = _http.post(url, data=_json_dumps(payload), headers=headers, timeout=60)
+            r.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            logger.error("[postmark] ✗ HTTP ERROR %s: %s", e.response.status_code, e.response.text)
+            results.extend([False] * len(chunk))
+            continue
+        except Exception as e:
+            logger.error("[postmark] ✗ ERROR: %s", e)
+            results.extend([False] * len(chunk))
+            continue
+        try:
+            answers = _json_loads(r.content) if r.content else None
+        except Exception:
+            answers = None
+        if not isinstance(answers, list):
+            # 2xx, aber kein Ergebnis-Array: nichts bestätigt → als nicht versendet werten
+            logger.warning("[postmark] unerwartete Batch-Antwort für %s Mails: %.200r",
+                           len(chunk), answers)
+            results.extend([False] * len(chunk))
+            continue
+        if len(answers) != len(chunk):
+            logger.warning("[postmark] %s Ergebnisse für %s Mails – unbestätigte gelten als nicht versendet",
+                           len(answers), len(chunk))
+        # nur ErrorCode == 0 zählt; fehlende/kaputte Einträge (auch der Rest) = nicht versendet
+        answers = answers[:len(chunk)] + [None] * (len(chunk) - len(answers))
+        for (to_addr, _, _), ans in zip(chunk, answers):
+            if not isinstance(ans, dict):
+                results.append(False)
+            elif ans.get("ErrorCode") == 0:
+                logger.info("[postmark] ✓ Sent to %s (ID: %s)", to_addr, ans.get("MessageID", "unknown"))
+                results.append(True)
+            else:
+                logger.error("[postmark] ✗ %s: %s %s", to_addr, ans.get("ErrorCode"), ans.get("Message"))
+                results.append(False)
+    return results
+
+def _addr_header(addr: str) -> str:
+    """Adresse für From/To: Anzeigename nach RFC 2047, die Adresse selbst bleibt wie sie ist."""
+    name, email = parseaddr(addr)
+    if not email:
+        return addr
+    if email.isascii():
+        return formataddr((name, email), charset="utf-8")
+    # formataddr lehnt Nicht-ASCII-Adressen ab – die gehen roh (SMTPUTF8) raus
+    return f"{Header(name, 'utf-8').encode()} <{email}>" if name else email
+
+def _envelope_addr(addr: str) -> str:
+    """Reine Adresse für MAIL FROM/RCPT TO („Name <a@b.de>“ → „a@b.de“)."""
+    return parseaddr(addr)[1] or addr
+
+def build_raw_mail(from_addr: str, to_addrs: List[str], subject: str, body_html: str) -> bytes:
+    """
+    Fertige RFC-5322-Bytes für eine reine HTML-Mail – ohne den Umweg über
+    EmailMessage/Generator. Body base64 (8bit-sicher), Betreff und Anzeigenamen
+    RFC 2047 nur wenn nötig. Nicht-ASCII-Adressen selbst (jörg@…) bleiben UTF-8 –
+    die gehen nur per SMTPUTF8 raus (siehe send_mail_smtp).
+    """
+    subj = subject if subject.isascii() else Header(subject, "utf-8").encode(linesep="\r\n")
+    domain = _envelope_addr(from_addr).rpartition("@")[2] or "localhost"
+    body = base64.encodebytes(body_html.encode("utf-8")).replace(b"\n", b"\r\n")
+    head = (
+        f"From: {_addr_header(from_addr)}\r\n"
+        f"To: {', '.join(_addr_header(t) for t in to_addrs)}\r\n"
+        f"Subject: {subj}\r\n"
+        f"Date: {formatdate()}\r\n"
+        f"Message-ID: {make_msgid(domain=domain)}\r\n"
+        "MIME-Version: 1.0\r\n"
+        "Content-Type: text/html; charset=utf-8\r\n"
+        "Content-Transfer-Encoding: base64\r\n"
+        "\r\n"
+    )
+    return head.encode("utf-8") + body
+
+def open_smtp(settings: Mapping[str, object]) -> smtplib.SMTP:
+    """Verbindet (SSL oder STARTTLS) und meldet sich an; Aufrufer schließt."""
+    host = settings.get("host"); port = int(settings.get("port") or 0)
+    user = settings.get("user");  pwd  = settings.get("password")
+    if settings.get("use_ssl"):
+        s = smtplib.SMTP_SSL(host, port, context=ssl.create_default_context(), timeout=60)
+    else:
+        s = smtplib.SMTP(host, port, timeout=60)
+    try:
+        if not settings.get("use_ssl") and settings.get("use_tls"):
+            s.starttls(context=ssl.create_default_context())
+        if user:
+            s.login(user, pwd)
+    except Exception:
+        s.close()
+        raise
+    return s
+
+class SMTPSession:
+    """
+    Eine SMTP-Verbindung für alle Mails eines Laufs: Handshake/TLS/AUTH nur einmal.
+    Verbindet lazy beim ersten Versand und einmal neu, falls der Server zwischendurch trennt.
+    Nach SMTP_MAX_MSGS_PER_CONN Mails bzw. SMTP_MAX_CONN_AGE Sekunden wird neu verbunden
+    (viele Provider kappen lange Sessions); nach längerer Pause prüft ein NOOP die Verbindung.
+    """
+
+    IDLE_PROBE = 30.0
+
+    def __init__(self, settings: Mapping[str, object]):
+        self.settings = settings
+        self._conn: Optional[smtplib.SMTP] = None
+        self._opened = 0.0
+        self._last_used = 0.0
+        self._sent = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        self.close()
+        self._conn = open_smtp(self.settings)
+        self._opened = self._last_used = time.monotonic()
+        self._sent = 0
+        return self._conn
+
+    def get(self) -> smtplib.SMTP:
+        """Lebende Verbindung liefern – alt/voll/tot → neu verbinden."""
+        if self._conn is None:
+            return self._connect()
+        now = time.monotonic()
+        if self._sent >= SMTP_MAX_MSGS_PER_CONN or now - self._opened >= SMTP_MAX_CONN_AGE:
+            return self._connect()
+        if now - self._last_used >= self.IDLE_PROBE:
+            try:
+                if self._conn.noop()[0] != 250:
+                    return self._connect()
+            except (smtplib.SMTPException, OSError):
+                return self._connect()
+        return self._conn
+
+    def sendmail(self, from_addr: str, to_addrs: List[str], raw: bytes,
+                 mail_options: Tuple[str, ...] = ()) -> None:
+        conn = self.get()
+        try:
+            conn.sendmail(from_addr, to_addrs, raw, mail_options)
+        except smtplib.SMTPServerDisconnected:
+            conn = self._connect()
+            conn.sendmail(from_addr, to_addrs, raw, mail_options)
+        self._sent += 1
+        self._last_used = time.monotonic()
+
+    def close(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.quit()
+        except (smtplib.SMTPException, OSError):
+            self._conn.close()
+        self._conn = None
+
+    def __enter__(self) -> "SMTPSession":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def send_mail_smtp(settings: Mapping[str, object], to_addrs: Iterable[str],
+                   subject: str, body_html: str,
+                   session: Optional[SMTPSession] = None) -> bool:
     host = settings.get("host"); port = int(settings.get("port") or 0)
     user = settings.get("user");  pwd  = settings.get("password")
     from_addr = settings.get("from")
     use_tls = bool(settings.get("use_tls")); use_ssl = bool(settings.get("use_ssl"))
 
     if not host or not port or not from_addr:
-        print("[mail] SMTP config incomplete -> skip")
+        logger.warning("[mail] SMTP config incomplete -> skip")
         return False
     if user and not pwd:
-        print("[mail] SMTP password missing -> skip")
+        logger.warning("[mail] SMTP password missing -> skip")
         return False
 
-    msg = EmailMessage()
-    msg["From"] = str(from_addr)
-    msg["To"]   = ", ".join([t for t in to_addrs if t])
-    msg["Subject"] = subject
-    msg.set_content("HTML only")
-    msg.add_alternative(body_html, subtype="html")
+    rcpts = [t for t in to_addrs if t]
 
+    # im try: eine kaputte Adresse lässt nur diese Mail scheitern, nicht den ganzen Lauf
     try:
-        if use_ssl:
-            ctx = ssl.create_default_context()
-            with smtplib.SMTP_SSL(host, port, context=ctx, timeout=60) as s:
-                if user: s.login(user, pwd)
-                s.send_message(msg)
+        raw = build_raw_mail(str(from_addr), rcpts, subject, body_html)
+        sender = _envelope_addr(str(from_addr))
+        envelope = [_envelope_addr(t) for t in rcpts]
+        # Nicht-ASCII in den Adressen selbst braucht SMTPUTF8 (RFC 6531)
+        opts = () if sender.isascii() and all(t.isascii() for t in envelope) else ("SMTPUTF8",)
+        if session is not None:
+            session.sendmail(sender, envelope, raw, opts)
         else:
-            with smtplib.SMTP(host, port, timeout=60) as s:
-                if use_tls: s.starttls(context=ssl.create_default_context())
-                if user: s.login(user, pwd)
-                s.send_message(msg)
-        print(f"[mail] sent via SMTP {host}:{port} tls={use_tls} ssl={use_ssl}")
+            with open_smtp(settings) as s:
+                s.sendmail(sender, envelope, raw, opts)
+        logger.info("[mail] sent via SMTP %s:%s tls=%s ssl=%s", host, port, use_tls, use_ssl)
         return True
     except Exception as e:
-        print(f"[mail] SMTP ERROR: {e}")
+        logger.error("[mail] SMTP ERROR: %s", e)
         return False
 
-def send_mail(settings: Dict[str, object], to_addrs: Iterable[str],
-              subject: str, body_html: str) -> bool:
+def send_mail(settings: Mapping[str, object], to_addrs: Iterable[str],
+              subject: str, body_html: str,
+              smtp: Optional[SMTPSession] = None) -> bool:
     provider = (settings.get("provider") or "smtp").lower()
     if provider == "postmark":
         return send_mail_postmark(
@@ -271,11 +658,23 @@ def send_mail(settings: Dict[str, object], to_addrs: Iterable[str],
             subject=subject,
             body_html=body_html,
         )
-    return send_mail_smtp(settings, to_addrs, subject, body_html)
+    return send_mail_smtp(settings, to_addrs, subject, body_html, session=smtp)
+
+def send_mail_batch(settings: Mapping[str, object], messages: List[Tuple[str, str, str]],
+                    smtp: Optional[SMTPSession] = None) -> List[bool]:
+    """Mehrere Mails (to, subject, html); Postmark in Batch-Requests, SMTP einzeln über smtp."""
+    if not messages:
+        return []
+    if (settings.get("provider") or "smtp").lower() == "postmark":
+        return send_mail_postmark_batch(settings.get("api_key"), settings.get("from"), messages)
+    return [send_mail(settings, [to], subject, html, smtp=smtp) for to, subject, html in messages]
 
 # -----------------------
 # De-Dup kompatibel zur app.py
 # -----------------------
+# Format muss bitgleich zu app.py::_make_search_hash bleiben (bestehende alert_seen-Zeilen)
+_HASH_ENCODER = json.JSONEncoder(sort_keys=True, ensure_ascii=False)
+
 def make_search_hash(terms: List[str], filters: Dict[str, object]) -> str:
     payload = {
         "terms": [t.strip() for t in terms if str(t).strip()],
@@ -286,59 +685,196 @@ def make_search_hash(terms: List[str], filters: Dict[str, object]) -> str:
             "conditions": sorted(filters.get("conditions") or []),
         },
     }
-    s = json.dumps(payload, sort_keys=True, ensure_ascii=False)
-    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+    return hashlib.sha1(_HASH_ENCODER.encode(payload).encode("utf-8")).hexdigest()
 
-def mark_and_filter_new(user_email: str, search_hash: str, src: str,
-                        items: List[Dict]) -> List[Dict]:
+# Nach erfolgreichem Versand: ein executemany-UPSERT statt SELECT+INSERT pro Item.
+# Neue IDs werden mit last_sent=now angelegt; Altzeilen mit last_sent=0 (aus früheren
+# Versionen, die schon vor dem Versand eingetragen haben) bekommen den Zeitstempel.
+# Schon versendete Zeilen behalten ihren. UPSERT braucht SQLite >= 3.24.
+_SQL_RECORD_SEEN = """
+    INSERT INTO alert_seen (user_email, search_hash, src, item_id, first_seen, last_sent)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_email, search_hash, src, item_id)
+        DO UPDATE SET last_sent = excluded.last_sent
+        WHERE alert_seen.last_sent = 0
+"""
+
+# Welche der gefundenen IDs sind schon versendet? PK-Lookups nur für die aktuellen
+# Treffer statt alle versendeten IDs des Alerts zu lesen (die wachsen mit der Zeit).
+_SQL_SENT_IDS = """
+    SELECT item_id FROM alert_seen
+    WHERE user_email=? AND search_hash=? AND src=? AND last_sent > 0 AND item_id IN ({})
+"""
+_IN_CHUNK = 500  # unter SQLITE_MAX_VARIABLE_NUMBER (999 bei alten Builds)
+
+@lru_cache(maxsize=None)
+def _sql_sent_ids(n: int) -> str:
+    return _SQL_SENT_IDS.format(",".join("?" * n))
+
+def _in_bucket(n: int) -> int:
+    # IN-Listen auf 8, 16, 32, … Platzhalter aufrunden: so gibt es nur eine Handvoll
+    # SQL-Texte statt bis zu _IN_CHUNK, und die bleiben im Statement-Cache der Verbindung
+    size = 8
+    while size < n:
+        size *= 2
+    return min(size, _IN_CHUNK)
+
+def _sent_ids(conn: sqlite3.Connection, user_email: str, search_hash: str, src: str,
+              iids: List[str]) -> set:
+    sent: set = set()
+    for i in range(0, len(iids), _IN_CHUNK):
+        chunk = iids[i:i + _IN_CHUNK]
+        size = _in_bucket(len(chunk))
+        chunk += chunk[-1:] * (size - len(chunk))  # Auffüllen mit Duplikaten ändert das IN nicht
+        sql = _sql_sent_ids(size)
+        sent.update(r[0] for r in conn.execute(sql, (user_email, search_hash, src, *chunk)))
+    return sent
+
+def _item_key(it: Dict) -> str:
+    """Schlüssel eines Items in alert_seen.item_id (von ebay_search schon als _iid gesetzt)."""
+    return it.get("_iid") or str(it.get("id") or it.get("url") or it.get("title"))[:255]
+
+def record_items(user_email: str, search_hash: str, src: str, items: List[Dict],
+                 conn: Optional[sqlite3.Connection] = None) -> None:
+    """
+    Trägt zugestellte Items per UPSERT in alert_seen ein (last_sent=now).
+    Ohne conn: eigene Transaktion. Mit conn: Commit macht der Aufrufer.
+    """
     if not items:
-        return []
+        return
     now = int(time.time())
-    conn = get_db(); cur = conn.cursor()
-    new_items: List[Dict] = []
-    for it in items:
-        iid = str(it.get("id") or it.get("url") or it.get("title"))[:255]
-        cur.execute("""
-            SELECT last_sent FROM alert_seen
-            WHERE user_email=? AND search_hash=? AND src=? AND item_id=?
-        """, (user_email, search_hash, src, iid))
-        row = cur.fetchone()
-        if not row:
-            new_items.append(it)
-            cur.execute("""
-                INSERT INTO alert_seen (user_email, search_hash, src, item_id, first_seen, last_sent)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (user_email, search_hash, src, iid, now, 0))
-        else:
-            if int(row["last_sent"] or 0) == 0:
-                new_items.append(it)
-    conn.commit(); conn.close()
-    return new_items
+    rows = [(user_email, search_hash, src, _item_key(it), now, now) for it in items]
+    if conn is not None:
+        conn.executemany(_SQL_RECORD_SEEN, rows)
+        return
+    conn = get_db()
+    with conn:
+        conn.executemany(_SQL_RECORD_SEEN, rows)
 
-def mark_sent(user_email: str, search_hash: str, src: str, items: List[Dict]) -> None:
+def filter_new(user_email: str, search_hash: str, src: str, items: List[Dict],
+               conn: Optional[sqlite3.Connection] = None) -> List[Dict]:
+    """
+    Items, die diesem Nutzer für diese Suche noch nicht gemailt wurden – nur lesend.
+    Eingetragen wird erst nach erfolgreichem Versand (mark_sent), damit alert_seen keine
+    Zeilen für nie zugestellte Treffer sammelt.
+    """
     if not items:
-        return
+        return []
+    iids = [_item_key(it) for it in items]
+    sent = _sent_ids(conn or get_db(), user_email, search_hash, src, iids)
+    return [it for it, iid in zip(items, iids) if iid not in sent]
+
+def mark_sent(user_email: str, search_hash: str, src: str, items: List[Dict],
+              conn: Optional[sqlite3.Connection] = None) -> None:
+    """Ohne conn: eigene Transaktion. Mit conn: Commit macht der Aufrufer."""
+    record_items(user_email, search_hash, src, items, conn=conn)
+
+_SQL_UPDATE_LAST_RUN = "UPDATE search_alerts SET last_run_ts=? WHERE id=?"
+
+_GC_INTERVAL = 86400
+_SQL_GC_SEEN = "DELETE FROM alert_seen WHERE last_sent > 0 AND last_sent < ?"
+
+def maybe_gc_alert_seen(conn: Optional[sqlite3.Connection] = None) -> int:
+    """
+    Löscht höchstens einmal pro Tag versendete alert_seen-Zeilen, die älter als
+    ALERT_SEEN_RETENTION_DAYS sind. Kein VACUUM (blockiert) – freie Seiten werden wiederverwendet.
+    """
+    if ALERT_SEEN_RETENTION_DAYS <= 0:
+        return 0
+    conn = conn or get_db()
     now = int(time.time())
-    conn = get_db(); cur = conn.cursor()
-    for it in items:
-        iid = str(it.get("id") or it.get("url") or it.get("title"))[:255]
-        cur.execute("""
-            UPDATE alert_seen SET last_sent=?
-            WHERE user_email=? AND search_hash=? AND src=? AND item_id=?
-        """, (now, user_email, search_hash, src, iid))
-    conn.commit(); conn.close()
+    row = conn.execute("SELECT v FROM kv WHERE k='alert_seen_gc_ts'").fetchone()
+    if row and now - int(row[0]) < _GC_INTERVAL:
+        return 0
+    with conn:
+        deleted = conn.execute(_SQL_GC_SEEN, (now - ALERT_SEEN_RETENTION_DAYS * 86400,)).rowcount
+        conn.execute("INSERT OR REPLACE INTO kv (k, v) VALUES ('alert_seen_gc_ts', ?)", (str(now),))
+    if deleted:
+        logger.info("[agent] alert_seen gc: %s alte Einträge entfernt", deleted)
+        # nur bei DBs mit auto_vacuum=INCREMENTAL (2); ältere Dateien behalten die freien Seiten
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            # executescript läuft bis zum Ende (execute gäbe nur eine Seite pro Schritt frei)
+            conn.executescript("PRAGMA incremental_vacuum")
+    return deleted
 
 # -----------------------
 # eBay API
 # -----------------------
-_EBAY_TOKEN: Dict[str, object] = {"access_token": None, "expires_at": 0.0}
+# (access_token, expires_at) – wird als Ganzes ersetzt, Leser sehen nie ein halbes Update
+_EBAY_TOKEN: Tuple[Optional[str], float] = (None, 0.0)
+
+_EBAY_TOKEN_LOCK = threading.Lock()
+# Threads entstehen erst beim ersten submit(); I/O-bound, daher unabhängig von der CPU-Zahl
+_EBAY_POOL = ThreadPoolExecutor(max_workers=EBAY_CONCURRENCY, thread_name_prefix="ebay")
+# eigener kleiner Pool für Telegram, damit Bot-API-Latenz nicht die eBay-Worker belegt
+_TG_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="telegram")
+# Einzel-Items eines Telegram-Alerts; getrennt von _TG_POOL, damit ein Alert-Job
+# nicht auf Worker seines eigenen (vollen) Pools wartet
+_TG_ITEM_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="telegram-item")
+
+def _cached_token() -> Optional[str]:
+    tok, exp = _EBAY_TOKEN
+    if tok and time.time() < exp:
+        return tok
+    return None
 
 def ebay_get_token() -> Optional[str]:
-    now = time.time()
-    if _EBAY_TOKEN["access_token"] and now < float(_EBAY_TOKEN["expires_at"] or 0):
-        return str(_EBAY_TOKEN["access_token"])
+    tok = _cached_token()
+    if tok:
+        return tok
+    # parallele Suchen sollen nicht gleichzeitig je ein neues Token holen
+    with _EBAY_TOKEN_LOCK:
+        tok = _cached_token() or _load_token_from_db()
+        if tok:
+            return tok
+        tok = _fetch_token()
+        if tok:
+            _store_token(tok, _EBAY_TOKEN[1])
+        return tok
+
+# Token prozessübergreifend in SQLite (Cron-Starts, mehrere Worker): eigene kurze
+# Verbindung, weil das aus Pool-Threads kommt und nicht in eine offene Transaktion
+# der Hauptverbindung schreiben darf.
+def _token_db() -> sqlite3.Connection:
+    return sqlite3.connect(DB_FILE, timeout=10)
+
+def _load_token_from_db() -> Optional[str]:
+    global _EBAY_TOKEN
+    try:
+        conn = _token_db()
+        try:
+            row = conn.execute(
+                "SELECT access_token, expires_at FROM ebay_token WHERE client_id=?",
+                (EBAY_CLIENT_ID,),
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.debug("[ebay_token] db read: %s", e)
+        return None
+    if not row or not row[0] or time.time() >= row[1]:
+        return None
+    _EBAY_TOKEN = (row[0], float(row[1]))
+    return row[0]
+
+def _store_token(tok: str, expires_at: float) -> None:
+    try:
+        conn = _token_db()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO ebay_token (client_id, access_token, expires_at) VALUES (?, ?, ?)",
+                    (EBAY_CLIENT_ID, tok, int(expires_at)),
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("[ebay_token] db write: %s", e)
+
+def _fetch_token() -> Optional[str]:
+    global _EBAY_TOKEN
     if not EBAY_CLIENT_ID or not EBAY_CLIENT_SECRET:
-        print("[ebay] Missing client id/secret")
+        logger.error("[ebay] Missing client id/secret")
         return None
     url = "https://api.ebay.com/identity/v1/oauth2/token"
     auth = requests.auth.HTTPBasicAuth(EBAY_CLIENT_ID, EBAY_CLIENT_SECRET)
@@ -346,51 +882,102 @@ def ebay_get_token() -> Optional[str]:
     try:
         r = _http.post(url, auth=auth, data=data, timeout=20)
         r.raise_for_status()
-        j = r.json() or {}
-        _EBAY_TOKEN["access_token"] = j.get("access_token")
-        _EBAY_TOKEN["expires_at"] = time.time() + int(j.get("expires_in", 7200)) - 60
-        return str(_EBAY_TOKEN["access_token"])
+        j = _json_loads(r.content) if r.content else {}
+        tok = j.get("access_token")
+        _EBAY_TOKEN = (tok, time.time() + int(j.get("expires_in", 7200)) - 60)
+        return tok
     except Exception as e:
-        print(f"[ebay_token] {e}")
+        logger.error("[ebay_token] %s", e)
         return None
 
-def _build_ebay_filter(price_min: str, price_max: str, conditions: List[str]) -> Optional[str]:
+_PRICE_CURRENCY = f"priceCurrency:{EBAY_CURRENCY}" if EBAY_CURRENCY else None
+
+@lru_cache(maxsize=128)
+def _ebay_filter(pmn: str, pmx: str, conds: Tuple[str, ...]) -> Optional[str]:
     parts: List[str] = []
-    pmn = (price_min or "").strip()
-    pmx = (price_max or "").strip()
     if pmn or pmx:
         parts.append(f"price:[{pmn}..{pmx}]")
-        if EBAY_CURRENCY:
-            parts.append(f"priceCurrency:{EBAY_CURRENCY}")
-    conds = [c.strip().upper() for c in (conditions or []) if c and c.strip()]
+        if _PRICE_CURRENCY:
+            parts.append(_PRICE_CURRENCY)
     if conds:
         parts.append("conditions:{" + ",".join(conds) + "}")
     return ",".join(parts) if parts else None
 
-def _map_sort(s: str) -> Optional[str]:
-    s = (s or "").strip().lower()
-    if not s or s == "best":
+def _build_ebay_filter(price_min: str, price_max: str, conditions: List[str]) -> Optional[str]:
+    # ohne Preis/Zustand (häufigster Fall) gar nicht erst normalisieren
+    if not price_min and not price_max and not conditions:
         return None
-    if s == "price_asc":
-        return "price"
-    if s == "price_desc":
-        return "-price"
-    if s == "newly":
-        return "newlyListed"
-    return None
+    return _ebay_filter(
+        (price_min or "").strip(), (price_max or "").strip(),
+        tuple(c.strip().upper() for c in (conditions or []) if c and c.strip()),
+    )
+
+_SORT_MAP = {"price_asc": "price", "price_desc": "-price", "newly": "newlyListed"}
+
+def _map_sort(s: str) -> Optional[str]:
+    return _SORT_MAP.get((s or "").strip().lower())
+
+class _RateLimiter:
+    """Verteilt Calls gleichmäßig auf max. rps pro Sekunde (threadsicher, ohne Burst)."""
+
+    def __init__(self, rps: float):
+        self.interval = 1.0 / rps if rps > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+_EBAY_LIMITER = _RateLimiter(EBAY_MAX_RPS)
+
+# geteilter, unveränderlicher Leer-Fallback für fehlende image/price-Objekte
+_EMPTY = MappingProxyType({})
+
+# Negativ-Cache: (q, filter, sort) → Zeitpunkt einer Antwort ohne Treffer. Bleibt über
+# Läufe erhalten, solange der Prozess lebt (app.py ruft run_agent_once im Webprozess auf).
+_EMPTY_SEEN: Dict[Tuple[str, str, Optional[str]], float] = {}
+_EMPTY_MAX = 2048
+
+def _recently_empty(key: Tuple[str, str, Optional[str]]) -> bool:
+    ts = _EMPTY_SEEN.get(key)
+    if ts is None:
+        return False
+    if time.monotonic() - ts < EBAY_EMPTY_TTL:
+        return True
+    _EMPTY_SEEN.pop(key, None)
+    return False
+
+def _remember_empty(key: Tuple[str, str, Optional[str]]) -> None:
+    if len(_EMPTY_SEEN) >= _EMPTY_MAX:
+        _EMPTY_SEEN.clear()
+    _EMPTY_SEEN[key] = time.monotonic()
 
 def ebay_search(term: str, limit: int, offset: int,
                 price_min: str, price_max: str,
                 conditions: List[str], sort_ui: str) -> List[Dict]:
+    if not term:
+        return []
+    filt = _build_ebay_filter(price_min, price_max, conditions)
+    srt = _map_sort(sort_ui)
+    # ohne Treffer ist die Trefferzahl unabhängig von limit – daher nicht Teil des Schlüssels
+    empty_key = (term.strip().lower(), filt, srt)
+    if offset <= 0 and EBAY_EMPTY_TTL > 0 and _recently_empty(empty_key):
+        logger.debug("[ebay_search] skip (kürzlich ohne Treffer): %s", term)
+        return []
     tok = ebay_get_token()
-    if not tok or not term:
+    if not tok:
         return []
     url = "https://api.ebay.com/buy/browse/v1/item_summary/search"
     params = {"q": term, "limit": max(1, min(limit, 50)), "offset": max(0, offset)}
-    filt = _build_ebay_filter(price_min, price_max, conditions)
     if filt:
         params["filter"] = filt
-    srt = _map_sort(sort_ui)
     if srt:
         params["sort"] = srt
     headers = {
@@ -398,139 +985,295 @@ def ebay_search(term: str, limit: int, offset: int,
         "X-EBAY-C-MARKETPLACE-ID": EBAY_MARKETPLACE_ID,
     }
     try:
+        _EBAY_LIMITER.wait()
         r = _http.get(url, headers=headers, params=params, timeout=20)
         r.raise_for_status()
-        j = r.json() or {}
-        items: List[Dict] = []
-        for it in (j.get("itemSummaries") or []):
-            items.append({
-                "id": it.get("itemId") or it.get("legacyItemId") or it.get("itemWebUrl"),
-                "title": it.get("title") or "—",
-                "url": it.get("itemWebUrl"),
-                "img": (it.get("image") or {}).get("imageUrl"),
-                "price": (it.get("price") or {}).get("value"),
-                "cur": (it.get("price") or {}).get("currency"),
-                "src": "ebay",
-            })
+        j = _json_loads(r.content) if r.content else {}
+        items = [{
+            "id": it.get("itemId") or it.get("legacyItemId") or it.get("itemWebUrl"),
+            "title": it.get("title") or "—",
+            "url": it.get("itemWebUrl"),
+            "img": (it.get("image") or _EMPTY).get("imageUrl"),
+            "price": (p := it.get("price") or _EMPTY).get("value"),
+            "cur": p.get("currency"),
+            "src": "ebay",
+        } for it in (j.get("itemSummaries") or ())]
+        if not items and offset <= 0 and EBAY_EMPTY_TTL > 0:
+            _remember_empty(empty_key)
+        # De-Dup-Schlüssel einmal hier bilden statt in jedem Verbraucher
+        for it in items:
+            it["_iid"] = _item_key(it)
         return items
     except Exception as e:
-        print(f"[ebay_search] {e}")
+        logger.error("[ebay_search] %s", e)
         return []
 
+def _search_term(term: str, per_term: int, filters: Dict[str, object]) -> List[Dict]:
+    return ebay_search(
+        term=term, limit=per_term, offset=0,
+        price_min=filters.get("price_min", ""),
+        price_max=filters.get("price_max", ""),
+        conditions=filters.get("conditions") or [],
+        sort_ui=filters.get("sort", "best"),
+    )
+
+def _search_key(term: str, per_term: int, filters: Dict[str, object]) -> Tuple:
+    return (
+        term.strip().lower(), per_term,
+        filters.get("price_min", ""), filters.get("price_max", ""),
+        tuple(sorted(filters.get("conditions") or [])), filters.get("sort", "best"),
+    )
+
+def submit_terms(terms: List[str], per_term: int, filters: Dict[str, object],
+                 memo: Optional[Dict[Tuple, Future]] = None) -> List[Future]:
+    """
+    Startet die Suchen aller Begriffe im Pool; Ergebnis später über collect_items().
+    Mit memo (pro Lauf) teilen sich Alerts mit gleichem Begriff+Filter einen Call.
+    """
+    if memo is None:
+        return [_EBAY_POOL.submit(_search_term, t, per_term, filters) for t in terms]
+    futures: List[Future] = []
+    for t in terms:
+        key = _search_key(t, per_term, filters)
+        f = memo.get(key)
+        if f is None:
+            f = memo[key] = _EBAY_POOL.submit(_search_term, t, per_term, filters)
+        futures.append(f)
+    return futures
+
+def collect_items(futures: List[Future]) -> List[Dict]:
+    items_all: List[Dict] = []
+    for f in futures:
+        items_all.extend(f.result())
+    return items_all
+
 # -----------------------
 # Alerts laden
 # -----------------------
+# Alerts ohne Begriffe oder ohne brauchbare Adresse gar nicht erst laden/parsen
+_SQL_LOAD_ALERTS = """
+    SELECT id, user_email, terms_json, filters_json, per_page, search_hash FROM search_alerts
+    WHERE is_active=1 AND instr(user_email, '@') > 0
+      AND terms_json NOT IN ('', '[]', 'null')
+"""
+
+@lru_cache(maxsize=1024)
+def _parse_alert_json(terms_json: Optional[str],
+                      filters_json: Optional[str]) -> Optional[Tuple[List[str], Dict[str, object]]]:
+    """
+    (terms, normalisierte Filter) aus den JSON-Spalten; None, wenn keine Begriffe.
+    Gecacht über den Rohtext: unveränderte Alerts werden im Dauerbetrieb (Scheduler in
+    app.py) nicht bei jedem Lauf neu geparst. Ergebnis wird geteilt – nur lesen!
+    """
+    try:
+        terms = [t for t in (_json_loads(terms_json or "[]") or []) if str(t).strip()]
+    except Exception:
+        return None
+    if not terms:
+        return None
+    try:
+        filters = _json_loads(filters_json or "{}") or {}
+    except Exception:
+        filters = {}
+    filters_norm = {
+        "price_min": (filters.get("price_min") or "").strip(),
+        "price_max": (filters.get("price_max") or "").strip(),
+        "sort": (filters.get("sort") or "best").strip(),
+        "conditions": [c.strip().upper() for c in (filters.get("conditions") or []) if c and str(c).strip()],
+    }
+    return terms, filters_norm
+
 def load_alerts() -> List[Dict]:
     conn = get_db()
-    rows = conn.execute(
-        "SELECT id, user_email, terms_json, filters_json, per_page FROM search_alerts WHERE is_active=1"
-    ).fetchall()
-    conn.close()
+    rows = conn.execute(_SQL_LOAD_ALERTS).fetchall()
     out: List[Dict] = []
+    missing: List[Tuple[str, int]] = []
     for r in rows:
-        try:
-            terms = json.loads(r["terms_json"] or "[]") or []
-        except Exception:
-            terms = []
-        try:
-            filters = json.loads(r["filters_json"] or "{}") or {}
-        except Exception:
-            filters = {}
-        filters_norm = {
-            "price_min": (filters.get("price_min") or "").strip(),
-            "price_max": (filters.get("price_max") or "").strip(),
-            "sort": (filters.get("sort") or "best").strip(),
-            "conditions": [c.strip().upper() for c in (filters.get("conditions") or []) if c and str(c).strip()],
-        }
+        parsed = _parse_alert_json(r["terms_json"], r["filters_json"])
+        if parsed is None:
+            continue
+        terms, filters_norm = parsed
         out.append({
             "id": int(r["id"]),
             "user_email": r["user_email"],
-            "terms": [t for t in terms if str(t).strip()],
+            "terms": terms,
             "filters": filters_norm,
             "per_page": int(r["per_page"] or 30),
+            "search_hash": r["search_hash"] or _backfill_hash(missing, r["id"], terms, filters_norm),
         })
+    if missing:
+        with conn:
+            conn.executemany("UPDATE search_alerts SET search_hash=? WHERE id=?", missing)
     return out
 
+def _backfill_hash(missing: List[Tuple[str, int]], alert_id: int,
+                   terms: List[str], filters: Dict[str, object]) -> str:
+    h = make_search_hash(terms, filters)
+    missing.append((h, int(alert_id)))
+    return h
+
 # -----------------------
 # E-Mail-Rendering (simpel, HTML)
 # -----------------------
+_MAIL_ROW = (
+    "<tr style='border-bottom:1px solid #eee'>"
+    "<td style='padding:8px;width:96px'><img src='{img}' width='96' height='72' style='border-radius:4px;object-fit:cover'></td>"
+    "<td style='padding:8px'><a href='{url}' target='_blank'>{title}</a><br>"
+    "<span style='color:#666;font-size:12px'>{price}</span></td>"
+    "</tr>"
+)
+_MAIL_IMG_PLACEHOLDER = "https://via.placeholder.com/96x72?text=%20"
+
+@lru_cache(maxsize=256)
+def _format_price(price: Optional[str], cur: Optional[str]) -> str:
+    # gleiche Preise wiederholen sich oft (Gruppen-Alerts, Festpreise) → escapter String aus dem Cache
+    return escape(f"{price} {cur}") if price and cur else "–"
+
+def _mail_row(it: Dict) -> str:
+    # alle Felder kommen von eBay → escapen (auch Preis/Währung sind nur Strings aus der API)
+    return _MAIL_ROW.format(
+        img=escape(it.get("img") or _MAIL_IMG_PLACEHOLDER),
+        url=escape(it.get("url") or "#"),
+        title=escape(it.get("title") or "—"),
+        price=_format_price(it.get("price"), it.get("cur")),
+    )
+
+_MAIL_BODY = (
+    "<div style='font-family:system-ui,Segoe UI,Roboto,Helvetica,Arial,sans-serif'>"
+    "<h3 style='margin:0 0 12px'>{title}</h3>"
+    "<table style='width:100%;border-collapse:collapse'>"
+    "{rows}"
+    "</table>"
+    "{more}"
+    "<p style='margin-top:16px;color:#666;font-size:12px'>Du erhältst diese Mail, weil du für diese Suche einen Alarm aktiviert hast.</p>"
+    "</div>"
+)
+_MAIL_MORE = "<p style='margin-top:8px'>+ {n} weitere Treffer …</p>"
+
 def render_email_html(title: str, items: List[Dict]) -> str:
-    rows = []
-    for it in items[:NOTIFY_MAX_ITEMS_PER_MAIL]:
-        price = f"{it.get('price')} {it.get('cur')}" if it.get("price") and it.get("cur") else "–"
-        img = it.get("img") or "https://via.placeholder.com/96x72?text=%20"
-        url = it.get("url") or "#"
-        title_txt = it.get("title") or "—"
-        rows.append(
-            "<tr style='border-bottom:1px solid #eee'>"
-            f"<td style='padding:8px;width:96px'><img src='{img}' width='96' height='72' style='border-radius:4px;object-fit:cover'></td>"
-            f"<td style='padding:8px'><a href='{url}' target='_blank'>{title_txt}</a><br>"
-            f"<span style='color:#666;font-size:12px'>{price}</span></td>"
-            "</tr>"
-        )
-    more = ""
-    if len(items) > NOTIFY_MAX_ITEMS_PER_MAIL:
-        more = f"<p style='margin-top:8px'>+ {len(items)-NOTIFY_MAX_ITEMS_PER_MAIL} weitere Treffer …</p>"
-    return (
-        "<div style='font-family:system-ui,Segoe UI,Roboto,Helvetica,Arial,sans-serif'>"
-        f"<h3 style='margin:0 0 12px'>{title}</h3>"
-        "<table style='width:100%;border-collapse:collapse'>"
-        + "".join(rows)
-        + "</table>"
-        f"{more}"
-        "<p style='margin-top:16px;color:#666;font-size:12px'>Du erhältst diese Mail, weil du für diese Suche einen Alarm aktiviert hast.</p>"
-        "</div>"
+    extra = len(items) - NOTIFY_MAX_ITEMS_PER_MAIL
+    return _MAIL_BODY.format(
+        title=escape(title),
+        rows="".join(map(_mail_row, items[:NOTIFY_MAX_ITEMS_PER_MAIL])),
+        more=_MAIL_MORE.format(n=extra) if extra > 0 else "",
+    )
+
+_MAIL_SECTION = "<tr><td colspan='2' style='padding:16px 8px 4px;font-weight:600'>{title}</td></tr>"
+
+def render_digest_html(title: str, sections: List[Tuple[str, List[Dict]]]) -> str:
+    """Sammelmail: ein Abschnitt pro Alert, NOTIFY_MAX_ITEMS_PER_MAIL gilt für die ganze Mail."""
+    rows: List[str] = []
+    budget = NOTIFY_MAX_ITEMS_PER_MAIL
+    total = 0
+    for heading, items in sections:
+        total += len(items)
+        shown = items[:max(budget, 0)]
+        if shown:
+            rows.append(_MAIL_SECTION.format(title=escape(heading)))
+            rows.extend(map(_mail_row, shown))
+            budget -= len(shown)
+    extra = total - NOTIFY_MAX_ITEMS_PER_MAIL
+    return _MAIL_BODY.format(
+        title=escape(title),
+        rows="".join(rows),
+        more=_MAIL_MORE.format(n=extra) if extra > 0 else "",
     )
 
 # -----------------------
 # Telegram Alert (optional)
 # -----------------------
-def send_telegram_alert(user_email: str, items: List[Dict], terms: List[str]) -> bool:
-    if not TELEGRAM_AVAILABLE:
+def _send_telegram_item(chat_id: str, item: Dict, agent_name: str) -> bool:
+    try:
+        return bool(send_new_item_alert(
+            chat_id=chat_id,
+            item={
+                "title": item.get("title", "Unbekannter Artikel"),
+                "price": str(item.get("price", "")),
+                "currency": item.get("cur", "EUR"),
+                "url": item.get("url", ""),
+                "image_url": item.get("img"),
+                "condition": "",
+                "location": "",
+            },
+            agent_name=agent_name,
+            with_image=bool(item.get("img")),
+        ))
+    except Exception as e:
+        logger.error("[telegram] Error sending item %s: %s", item.get("id"), e)
+        return False
+
+def load_telegram_targets() -> Dict[str, str]:
+    """Alle Nutzer mit aktivem Telegram in einer Query: {email: chat_id}."""
+    if not _load_telegram():
+        return {}
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(User.email, User.telegram_chat_id)
+            .filter(User.telegram_verified == True, User.telegram_enabled == True)  # noqa: E712
+            .all()
+        )
+        return {email: chat_id for email, chat_id in rows if email and chat_id}
+    except Exception as e:
+        logger.warning("[telegram] Could not load users: %s", e)
+        return {}
+    finally:
+        db.close()
+
+def send_telegram_alert(user_email: str, items: List[Dict], terms: List[str],
+                        chat_id: Optional[str] = None) -> bool:
+    """chat_id aus load_telegram_targets() spart die User-Query pro Alert."""
+    if not _load_telegram():
         return False
     try:
-        db = SessionLocal()
-        user = db.query(User).filter_by(email=user_email).first()
-        if not user or not user.telegram_verified or not user.telegram_enabled:
-            db.close()
-            if DEBUG_LOG:
-                print(f"[telegram] not enabled for: {user_email}")
+        if chat_id is None:
+            db = SessionLocal()
+            try:
+                user = db.query(User).filter_by(email=user_email).first()
+                if user and user.telegram_verified and user.telegram_enabled:
+                    chat_id = user.telegram_chat_id
+            finally:
+                db.close()
+        if not chat_id:
+            logger.debug("[telegram] not enabled for: %s", user_email)
             return False
         items_to_send = items[:NOTIFY_MAX_ITEMS_TELEGRAM]
-        sent_count = 0
-        for item in items_to_send:
-            try:
-                success = send_new_item_alert(
-                    chat_id=user.telegram_chat_id,
-                    item={
-                        "title": item.get("title", "Unbekannter Artikel"),
-                        "price": str(item.get("price", "")),
-                        "currency": item.get("cur", "EUR"),
-                        "url": item.get("url", ""),
-                        "image_url": item.get("img"),
-                        "condition": "",
-                        "location": "",
-                    },
-                    agent_name=f"eBay Alert: {', '.join(terms[:2])}",
-                    with_image=bool(item.get("img")),
-                )
-                if success:
-                    sent_count += 1
-            except Exception as e:
-                print(f"[telegram] Error sending item {item.get('id')}: {e}")
-        db.close()
+        agent_name = f"eBay Alert: {', '.join(terms[:2])}"
+        # Items parallel senden: Dauer ≈ langsamster einzelner Bot-API-Call statt Summe
+        results = _TG_ITEM_POOL.map(
+            lambda item: _send_telegram_item(chat_id, item, agent_name), items_to_send
+        )
+        sent_count = sum(1 for ok in results if ok)
         if sent_count > 0:
-            print(f"[telegram] Sent {sent_count}/{len(items_to_send)} items to {user_email}")
+            logger.info("[telegram] Sent %s/%s items to %s", sent_count, len(items_to_send), user_email)
             return True
         return False
     except Exception as e:
-        print(f"[telegram] Error sending alert to {user_email}: {e}")
+        logger.error("[telegram] Error sending alert to %s: %s", user_email, e)
         return False
 
 # -----------------------
 # Orchestrator
 # -----------------------
-def run_agent_once() -> None:
+def _combined_query(terms: List[str]) -> Optional[str]:
+    """Browse-API-ODER-Syntax "(a, b, c)" – nur für Ein-Wort-Begriffe eindeutig."""
+    words = [str(t).strip() for t in terms]
+    if len(words) < 2 or any(not w or " " in w or "," in w or "(" in w or ")" in w for w in words):
+        return None
+    return "(" + ", ".join(words) + ")"
+
+def _submit_alert_search(a: Dict, memo: Optional[Dict[Tuple, Future]] = None) -> List[Future]:
+    terms = a["terms"]
+    per_page = max(1, int(a["per_page"] or 30))
+    if EBAY_COMBINE_TERMS:
+        q = _combined_query(terms)
+        if q:
+            return submit_terms([q], per_page, a["filters"], memo)
+    # Suche – gleichmäßig über Begriffe verteilen
+    per_term = max(1, per_page // max(1, len(terms)))
+    return submit_terms(terms, per_term, a["filters"], memo)
+
+def _run_agent_once() -> None:
     """
     Ein Lauf:
       - Alerts laden
@@ -539,88 +1282,153 @@ def run_agent_once() -> None:
       - E-Mail (Postmark bevorzugt) & optional Telegram
       - Versandte Items markieren
     """
-    print("[agent] start run")
+    logger.info("[agent] start run")
     init_db_if_needed()
     mail_settings = get_mail_settings()
 
     alerts = load_alerts()
-    if DEBUG_LOG:
-        print(f"[agent] {len(alerts)} aktive Alerts")
+    logger.debug("[agent] %s aktive Alerts", len(alerts))
 
     total_checked = 0
     total_mailed = 0
     total_telegram = 0
 
+    runnable: List[Dict] = []
     for a in alerts:
         total_checked += 1
-        terms   = a["terms"]
-        filters = a["filters"]
-        per_page = max(1, int(a["per_page"] or 30))
-        if not terms:
-            continue
-
         # optional Pilot-Whitelist
         recipient = (a["user_email"] or "").strip()
         if PILOT_EMAILS and recipient.lower() not in PILOT_EMAILS:
-            if DEBUG_LOG:
-                print(f"[agent] skip (not whitelisted): {recipient}")
+            logger.debug("[agent] skip (not whitelisted): %s", recipient)
             continue
+        runnable.append(a)
 
-        # Suche – gleichmäßig über Begriffe verteilen
-        per_term = max(1, per_page // max(1, len(terms)))
-        items_all: List[Dict] = []
-        for t in terms:
-            items = ebay_search(
-                term=t, limit=per_term, offset=0,
-                price_min=filters.get("price_min", ""),
-                price_max=filters.get("price_max", ""),
-                conditions=filters.get("conditions") or [],
-                sort_ui=filters.get("sort", "best"),
-            )
-            items_all.extend(items)
-
-        # De-Dup
-        search_hash = make_search_hash(terms, filters)
-        groups: Dict[str, List[Dict]] = {}
-        for it in items_all:
-            src = (it.get("src") or "ebay").lower()
-            groups.setdefault(src, []).append(it)
-
-        new_all: List[Dict] = []
-        for src, group in groups.items():
-            new_items = mark_and_filter_new(recipient, search_hash, src, group)
-            new_all.extend(new_items)
-
-        if not new_all or not recipient or "@" not in recipient:
-            if DEBUG_LOG:
-                print(f"[agent] alert_id={a['id']} no new items or invalid email")
-            continue
+    conn = get_db()
+    tg_jobs: List[Tuple[str, Future]] = []
+    ran: List[Tuple[int, int]] = []
+    tg_targets = load_telegram_targets() if runnable else {}
 
-        subject = f"Neue Treffer für '{', '.join(terms)}' - {len(new_all)} neu"
-        html    = render_email_html(subject, new_all)
+    # Alerts mit gleichem search_hash (gleiche Begriffe+Filter, andere Nutzer) teilen sich
+    # EINE Suche – mit dem größten per_page der Gruppe. Alle Suchen gehen sofort in den
+    # Pool; während Alert i dedupliziert und gemailt wird, laufen die folgenden schon.
+    leaders: Dict[str, Dict] = {}
+    for a in runnable:
+        lead = leaders.setdefault(a["search_hash"], a)
+        if a["per_page"] > lead["per_page"]:
+            leaders[a["search_hash"]] = a
+    memo: Dict[Tuple, Future] = {}
+    by_hash = {h: _submit_alert_search(lead, memo) for h, lead in leaders.items()}
+    pending = [by_hash[a["search_hash"]] for a in runnable]
+    # Sammelmail: Treffer eines Nutzers bis zu seinem letzten Alert sammeln, dann sofort
+    # senden – die Suchen der übrigen Alerts laufen währenddessen weiter
+    last_idx = {(a["user_email"] or "").strip(): i for i, a in enumerate(runnable)}
+    digests: Dict[str, List[Tuple[Dict, Dict[str, List[Dict]], List[Dict]]]] = {}
+    # Postmark: fertige Mails sammeln und je bis zu 500 in einem Batch-Request senden;
+    # SMTP sendet sofort (Limit 1), damit der Versand parallel zu den Suchen läuft
+    outbox: List[Tuple[str, str, str, List[Tuple[Dict, Dict[str, List[Dict]], List[Dict]]]]] = []
+    batch_limit = POSTMARK_BATCH_MAX if mail_settings.get("provider") == "postmark" else 1
 
+    def flush_outbox(smtp: SMTPSession) -> None:
+        nonlocal total_mailed
+        if not outbox:
+            return
         # Versand (API-first)
-        if send_mail(mail_settings, [recipient], subject, html):
+        results = send_mail_batch(mail_settings, [m[:3] for m in outbox], smtp=smtp)
+        now = int(time.time())
+        for (recipient, _, _, entries), mailed in zip(outbox, results):
+            ran.extend((now, int(ea["id"])) for ea, _, _ in entries)
+            if not mailed:
+                continue
+
+            # versendete Items aller Alerts/Quellen der Mail in einer Transaktion
+            with conn:
+                for ea, by_src, _ in entries:
+                    for src, sent_items in by_src.items():
+                        mark_sent(recipient, ea["search_hash"], src, sent_items, conn)
+            total_mailed += len(entries)
+
+            # Telegram (optional) – im Hintergrund, blockiert den nächsten Alert nicht
+            chat_id = tg_targets.get(recipient)
+            if not chat_id:
+                logger.debug("[telegram] not enabled for: %s", recipient)
+                continue
+            for ea, _, items in entries:
+                tg_jobs.append((recipient, _TG_POOL.submit(
+                    send_telegram_alert, recipient, items, ea["terms"], chat_id)))
+        outbox.clear()
+
+    # eine SMTP-Verbindung für alle Mails des Laufs (verbindet erst beim ersten Versand)
+    with SMTPSession(mail_settings) as smtp:
+        for i, (a, futures) in enumerate(zip(runnable, pending)):
+            items_all = collect_items(futures)
+            recipient = (a["user_email"] or "").strip()
+
+            # De-Dup
+            search_hash = a["search_hash"]
+            # dasselbe Angebot trifft oft mehrere Begriffe – pro Quelle nur einmal prüfen/mailen
+            groups: Dict[str, Dict[str, Dict]] = {}
+            for it in items_all:
+                src = (it.get("src") or "ebay").lower()
+                groups.setdefault(src, {}).setdefault(_item_key(it), it)
+
+            new_by_src: Dict[str, List[Dict]] = {}
+            new_all: List[Dict] = []
+            # nur lesen – geschrieben wird erst nach dem Versand (mark_sent)
             for src, group in groups.items():
-                sent_subset = [it for it in new_all if (it.get("src") or "ebay").lower() == src]
-                mark_sent(recipient, search_hash, src, sent_subset)
-            total_mailed += 1
+                new_items = filter_new(recipient, search_hash, src, list(group.values()), conn)
+                new_by_src[src] = new_items
+                new_all.extend(new_items)
 
-            # Telegram (optional)
-            try:
-                if send_telegram_alert(recipient, new_all, terms):
-                    total_telegram += 1
-            except Exception as e:
-                print(f"[telegram] Failed for {recipient}: {e}")
+            if new_all:
+                digests.setdefault(recipient, []).append((a, new_by_src, new_all))
+            else:
+                logger.debug("[agent] alert_id=%s no new items", a["id"])
+            if ALERT_DIGEST and i != last_idx[recipient]:
+                continue
+            entries = digests.pop(recipient, None)
+            if not entries:
+                continue
+
+            total_new = sum(len(e[2]) for e in entries)
+            if len(entries) == 1:
+                subject = f"Neue Treffer für '{', '.join(entries[0][0]['terms'])}' - {total_new} neu"
+                html    = render_email_html(subject, entries[0][2])
+            else:
+                subject = f"Neue Treffer für {len(entries)} Suchen - {total_new} neu"
+                html    = render_digest_html(
+                    subject, [(", ".join(ea["terms"]), items) for ea, _, items in entries])
+
+            outbox.append((recipient, subject, html, entries))
+            if len(outbox) >= batch_limit:
+                flush_outbox(smtp)
+        flush_outbox(smtp)
 
-        # last_run_ts aktualisieren
-        conn = get_db()
-        conn.execute("UPDATE search_alerts SET last_run_ts=? WHERE id=?", (int(time.time()), int(a["id"])))
-        conn.commit(); conn.close()
+    # last_run_ts aller gelaufenen Alerts in einem Rutsch
+    if ran:
+        with conn:
+            conn.executemany(_SQL_UPDATE_LAST_RUN, ran)
+    maybe_gc_alert_seen(conn)
 
-    print(f"[agent] summary: alerts_checked={total_checked} alerts_emailed={total_mailed} alerts_telegram={total_telegram}")
-    print("[agent] end run")
+    # vor dem Ende auf alle Telegram-Sends warten (Cron-Prozess soll sie nicht abschneiden)
+    for recipient, f in tg_jobs:
+        try:
+            if f.result():
+                total_telegram += 1
+        except Exception as e:
+            logger.error("[telegram] Failed for %s: %s", recipient, e)
+
+    logger.info("[agent] summary: alerts_checked=%s alerts_emailed=%s alerts_telegram=%s",
+                total_checked, total_mailed, total_telegram)
+    logger.info("[agent] end run")
+
+def run_agent_once() -> None:
+    """Ein Lauf (siehe _run_agent_once); gepufferte Logzeilen gehen auch bei Fehlern raus."""
+    try:
+        _run_agent_once()
+    finally:
+        _flush_logs()
 
 if __name__ == "__main__":
+    _setup_script_logging()
     run_agent_once()
 
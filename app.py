@@ -54,6 +54,8 @@ try:
     load_dotenv()
 except Exception:
     pass
+# agent wurde schon oben importiert – Mail-Settings nach dem .env-Laden neu aufbauen
+get_mail_settings.cache_clear()
 
 # -------------------------------------------------------------------
 # App & Basis-Konfig
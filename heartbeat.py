@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import os
 import socket
-from datetime import datetime, timezone
+import time
 
 from mailer import get_bounce_stats, send_mail
 
@@ -14,7 +14,7 @@ print(f"[HEARTBEAT] Version 4.0 - Postmark API")
 print(f"[HEARTBEAT] Sending to: {', '.join(TO)}")
 
 host = socket.gethostname()
-ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%SZ")
+ts = time.strftime("%Y-%m-%d %H:%M:%SZ", time.gmtime())
 
 subject = f"✅ Heartbeat OK - {host}"
 stats = get_bounce_stats()
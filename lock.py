@@ -2,6 +2,7 @@
 import contextlib
 import os
 import time
+from typing import Optional
 
 LOCK_PATH = os.environ.get("AGENT_LOCK_PATH", "instance/agent.lock")
 
@@ -13,16 +14,69 @@ try:
 except Exception:
     HAVE_FCNTL = False
 
-from threading import Lock
+# Lockdatei ohne fcntl gilt nach so vielen Sekunden als verwaist (abgestürzter Lauf)
+STALE_AFTER = int(os.environ.get("AGENT_LOCK_STALE_SECONDS", "3600"))
+# Nebendatei eines beim Brechen abgestürzten Prozesses gilt nach so vielen Sekunden als verwaist
+BREAK_STALE_AFTER = 60
 
-_process_lock = Lock()
+
+def _try_create(token: str, path: Optional[str] = None) -> bool:
+    """Legt die Lockdatei atomar an (O_EXCL) – genau ein Prozess gewinnt."""
+    try:
+        fd = os.open(path or LOCK_PATH, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    return True
+
+
+def _read_token() -> str:
+    try:
+        with open(LOCK_PATH) as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def _is_stale(path: str) -> bool:
+    try:
+        return time.time() - os.stat(path).st_mtime > STALE_AFTER
+    except FileNotFoundError:
+        return False
+
+
+def _break_if_stale() -> None:
+    """
+    Entfernt eine verwaiste Lockdatei. Prüfen und Löschen sind zwei Schritte – damit
+    kein zweiter Prozess dazwischen eine frisch angelegte Lockdatei löscht, darf immer
+    nur einer brechen: wer die Nebendatei <LOCK_PATH>.break per O_EXCL anlegt.
+    """
+    if not _is_stale(LOCK_PATH):
+        return
+    break_path = LOCK_PATH + ".break"
+    if not _try_create(str(os.getpid()), break_path):
+        # Nebendatei eines abgestürzten Brechers: nach BREAK_STALE_AFTER wegräumen
+        with contextlib.suppress(OSError):
+            if time.time() - os.stat(break_path).st_mtime > BREAK_STALE_AFTER:
+                os.unlink(break_path)
+        return
+    try:
+        # erst jetzt prüfen: die Lockdatei kann nur noch ihr Besitzer entfernen
+        if _is_stale(LOCK_PATH):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(LOCK_PATH)
+    finally:
+        with contextlib.suppress(OSError):
+            os.unlink(break_path)
 
 
 @contextlib.contextmanager
 def agent_lock(timeout=110):
     """
     Sichert, dass immer nur EIN Agent-Lauf gleichzeitig startet.
-    Unter Linux per Datei-Lock (prozessübergreifend), sonst Fallback auf Prozess-Lock.
+    Unter Linux per fcntl-Datei-Lock, sonst per Lockdatei mit O_EXCL (beides prozessübergreifend;
+    eine Lockdatei älter als STALE_AFTER gilt als verwaist und wird ersetzt).
     """
     if HAVE_FCNTL:
         os.makedirs(os.path.dirname(LOCK_PATH), exist_ok=True)
@@ -45,11 +99,19 @@ def agent_lock(timeout=110):
                 pass
             f.close()
     else:
-        # Fallback (z.B. Windows lokal)
-        acquired = _process_lock.acquire(timeout=timeout)
-        if not acquired:
-            raise TimeoutError("Agent lock timeout")
+        # Fallback (z.B. Windows lokal): Lockdatei per O_EXCL, wirkt auch prozessübergreifend
+        os.makedirs(os.path.dirname(LOCK_PATH), exist_ok=True)
+        token = f"{os.getpid()} {time.time()}"
+        start = time.time()
+        while not _try_create(token):
+            _break_if_stale()
+            if time.time() - start > timeout:
+                raise TimeoutError("Agent lock timeout")
+            time.sleep(1)
         try:
             yield
         finally:
-            _process_lock.release()
+            # nur die eigene Lockdatei löschen
+            if _read_token() == token:
+                with contextlib.suppress(OSError):
+                    os.unlink(LOCK_PATH)
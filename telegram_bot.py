@@ -1,6 +1,7 @@
 # telegram_bot.py
 import logging
 import os
+import time
 from datetime import datetime
 from typing import Any, Dict, Optional
 
@@ -11,6 +12,30 @@ logger = logging.getLogger(__name__)
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
 
+# Eine Keep-Alive-Session für alle Bot-API-Calls (TLS-Handshake nur einmal,
+# auch wenn der Agent mehrere Nachrichten parallel schickt)
+_session = requests.Session()
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=16))
+
+# längste Wartezeit, die wir bei 429 (Flood-Limit) einmalig abwarten
+MAX_RETRY_AFTER = 30
+
+
+def _post(url: str, payload: Dict[str, Any]) -> requests.Response:
+    """POST an die Bot-API; bei 429 einmal retry_after abwarten und erneut senden."""
+    response = _session.post(url, json=payload, timeout=10)
+    if response.status_code != 429:
+        return response
+    try:
+        retry_after = int(response.json().get("parameters", {}).get("retry_after", 1))
+    except Exception:
+        retry_after = 1
+    if retry_after > MAX_RETRY_AFTER:
+        return response
+    logger.warning(f"Telegram 429 – warte {retry_after}s und sende erneut")
+    time.sleep(retry_after)
+    return _session.post(url, json=payload, timeout=10)
+
 
 class TelegramBot:
     """Telegram Bot Handler für eBay Alerts"""
@@ -77,9 +102,7 @@ class TelegramBot:
             if reply_markup:
                 payload["reply_markup"] = reply_markup
 
-            response = requests.post(
-                f"{self.api_url}/sendMessage", json=payload, timeout=10
-            )
+            response = _post(f"{self.api_url}/sendMessage", payload)
 
             if response.status_code == 200:
                 logger.info(f"✅ Telegram Nachricht gesendet an {chat_id}")
@@ -114,9 +137,7 @@ class TelegramBot:
             if reply_markup:
                 payload["reply_markup"] = reply_markup
 
-            response = requests.post(
-                f"{self.api_url}/sendPhoto", json=payload, timeout=10
-            )
+            response = _post(f"{self.api_url}/sendPhoto", payload)
 
             if response.status_code == 200:
                 logger.info(f"✅ Telegram Foto gesendet an {chat_id}")
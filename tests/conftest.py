@@ -0,0 +1,59 @@
+# tests/conftest.py
+"""Shared pytest setup and fixtures for the agent tests."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path so we can import agent
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import agent
+
+
+class FakeResponse:
+    """Minimal stand-in for a successful requests.Response."""
+
+    def __init__(self, content=b""):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def fake_response():
+    """The FakeResponse class, for stubbing agent._http.get/post."""
+    return FakeResponse
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point the agent at an empty DB and reset the shared connection."""
+    monkeypatch.setattr(agent, "DB_FILE", str(tmp_path / "agent.sqlite3"))
+    monkeypatch.setattr(agent, "_CONN", None)
+    agent.init_db_if_needed()
+    yield agent.get_db()
+    agent.get_db().close()
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """Record every ebay_search call as (term, limit); each term yields two items."""
+    seen = []
+
+    def fake_search(term, limit, offset, price_min, price_max, conditions, sort_ui):
+        seen.append((term, limit))
+        return [
+            {
+                "id": f"{term}-{i}",
+                "title": term,
+                "url": f"https://e/{term}/{i}",
+                "src": "ebay",
+            }
+            for i in range(2)
+        ]
+
+    monkeypatch.setattr(agent, "ebay_search", fake_search)
+    return seen
@@ -0,0 +1,362 @@
+# tests/test_agent_dedup.py
+"""
+Unit tests for the alert de-dup in agent.py.
+
+Each test runs against a fresh SQLite file in a temp directory; no network access needed.
+"""
+
+from pathlib import Path
+
+import pytest
+
+import agent
+
+
+def _ids(items):
+    return [it["id"] for it in items]
+
+
+class TestFilterNew:
+    """Test suite for filter_new / mark_sent."""
+
+    def test_schema_version(self, db):
+        """Test that all migrations are recorded in user_version."""
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        assert (
+            version == agent.MIGRATIONS[-1][0]
+        ), "user_version should match last migration"
+
+    def test_new_items_returned(self, db):
+        """Test that unknown items are returned without writing anything yet."""
+        items = [{"id": "a"}, {"id": "b"}]
+        assert _ids(agent.filter_new("u@x.de", "h", "ebay", items)) == ["a", "b"]
+        count = db.execute("SELECT COUNT(*) FROM alert_seen").fetchone()[0]
+        assert count == 0, "Rows are only written by mark_sent after delivery"
+
+    def test_unsent_items_returned_again(self, db):
+        """Test that seen-but-never-mailed rows (last_sent=0) stay new."""
+        db.execute(
+            "INSERT INTO alert_seen (user_email, search_hash, src, item_id, first_seen, last_sent) "
+            "VALUES ('u@x.de', 'h', 'ebay', 'a', 1, 0)"
+        )
+        db.commit()
+        assert _ids(agent.filter_new("u@x.de", "h", "ebay", [{"id": "a"}])) == ["a"]
+
+    def test_sent_items_filtered(self, db):
+        """Test that mailed items are not returned again."""
+        items = [{"id": "a"}, {"id": "b"}]
+        new = agent.filter_new("u@x.de", "h", "ebay", items)
+        agent.mark_sent("u@x.de", "h", "ebay", new[:1])
+        assert _ids(agent.filter_new("u@x.de", "h", "ebay", items)) == ["b"]
+
+    def test_scoped_by_user_and_hash(self, db):
+        """Test that de-dup state is per (user, search_hash)."""
+        items = [{"id": "a"}]
+        agent.mark_sent(
+            "u@x.de", "h", "ebay", agent.filter_new("u@x.de", "h", "ebay", items)
+        )
+        assert _ids(agent.filter_new("v@x.de", "h", "ebay", items)) == ["a"]
+        assert _ids(agent.filter_new("u@x.de", "h2", "ebay", items)) == ["a"]
+
+    def test_id_fallback_to_url(self, db):
+        """Test that items without id are keyed by url."""
+        items = [{"url": "https://ebay.de/itm/1", "title": "x"}]
+        agent.mark_sent(
+            "u@x.de", "h", "ebay", agent.filter_new("u@x.de", "h", "ebay", items)
+        )
+        assert agent.filter_new("u@x.de", "h", "ebay", items) == []
+
+    def test_empty_input(self, db):
+        """Test that no items means no DB work."""
+        assert agent.filter_new("u@x.de", "h", "ebay", []) == []
+
+    def test_alert_seen_without_rowid(self, db):
+        """Test that alert_seen is stored as a WITHOUT ROWID table."""
+        sql = db.execute(
+            "SELECT sql FROM sqlite_master WHERE name='alert_seen'"
+        ).fetchone()[0]
+        assert "WITHOUT ROWID" in sql
+
+    def test_migration_keeps_seen_rows(self, tmp_path, monkeypatch):
+        """Test that upgrading a v3 database keeps existing alert_seen rows."""
+        monkeypatch.setattr(agent, "DB_FILE", str(tmp_path / "old.sqlite3"))
+        monkeypatch.setattr(agent, "_CONN", None)
+        conn = agent.get_db()
+        for ver, sql in agent.MIGRATIONS[:3]:
+            conn.execute(sql)
+        conn.execute("PRAGMA user_version = 3")
+        conn.execute("INSERT INTO alert_seen VALUES ('u@x.de', 'h', 'ebay', 'a', 1, 2)")
+        conn.commit()
+        agent.init_db_if_needed()
+        assert _ids(
+            agent.filter_new("u@x.de", "h", "ebay", [{"id": "a"}, {"id": "b"}])
+        ) == ["b"]
+        conn.close()
+
+    def test_migration_keeps_init_db_columns(self, tmp_path, monkeypatch):
+        """Test that the WITHOUT ROWID rebuild keeps init_db.py's extra columns and indexes."""
+        monkeypatch.setattr(agent, "DB_FILE", str(tmp_path / "init_db.sqlite3"))
+        monkeypatch.setattr(agent, "_CONN", None)
+        conn = agent.get_db()
+        conn.execute(agent.MIGRATIONS[0][1])
+        conn.execute(
+            """
+            CREATE TABLE alert_seen (
+                user_email TEXT NOT NULL, search_hash TEXT NOT NULL, src TEXT NOT NULL,
+                item_id TEXT NOT NULL, first_seen INTEGER NOT NULL, last_sent INTEGER NOT NULL,
+                times_seen INTEGER DEFAULT 1,
+                price_first TEXT, price_current TEXT, price_lowest TEXT,
+                PRIMARY KEY (user_email, search_hash, src, item_id)
+            )
+        """
+        )
+        conn.execute("CREATE INDEX idx_seen_price ON alert_seen(price_lowest)")
+        conn.execute("PRAGMA user_version = 3")
+        conn.execute(
+            "INSERT INTO alert_seen VALUES ('u@x.de', 'h', 'ebay', 'a', 1, 2, 5, '9', '8', '7')"
+        )
+        conn.commit()
+        agent.init_db_if_needed()
+        cols = [r[1] for r in conn.execute("PRAGMA table_info(alert_seen)")]
+        assert cols == [
+            "user_email",
+            "search_hash",
+            "src",
+            "item_id",
+            "first_seen",
+            "last_sent",
+            "times_seen",
+            "price_first",
+            "price_current",
+            "price_lowest",
+        ]
+        assert tuple(conn.execute("SELECT * FROM alert_seen").fetchone()) == (
+            "u@x.de",
+            "h",
+            "ebay",
+            "a",
+            1,
+            2,
+            5,
+            "9",
+            "8",
+            "7",
+        )
+        sql = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE name='alert_seen'"
+        ).fetchone()[0]
+        assert "WITHOUT ROWID" in sql
+        assert conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='idx_seen_price'"
+        ).fetchone()
+        agent.mark_sent("u@x.de", "h", "ebay", [{"id": "b"}])
+        assert (
+            conn.execute(
+                "SELECT times_seen FROM alert_seen WHERE item_id='b'"
+            ).fetchone()[0]
+            == 1
+        )
+        conn.close()
+
+    def test_mark_sent_idempotent(self, db):
+        """Test that marking the same items twice neither duplicates rows nor moves the timestamp."""
+        db.execute(
+            "INSERT INTO alert_seen (user_email, search_hash, src, item_id, first_seen, last_sent) "
+            "VALUES ('u@x.de', 'h', 'ebay', 'a', 1, 0)"
+        )
+        db.commit()
+        agent.mark_sent("u@x.de", "h", "ebay", [{"id": "a"}, {"id": "b"}])
+        rows = dict(db.execute("SELECT item_id, last_sent FROM alert_seen"))
+        assert set(rows) == {"a", "b"}, "Re-marking must not duplicate rows"
+        assert all(rows.values()), "Legacy last_sent=0 row should be marked as sent"
+        before = db.total_changes
+        agent.mark_sent("u@x.de", "h", "ebay", [{"id": "a"}, {"id": "b"}])
+        assert db.total_changes == before, "Sent rows keep their timestamp"
+
+    def test_seen_lookup_uses_primary_key(self, db):
+        """Test that the padded IN lookup used by filter_new is a keyed search, not a scan."""
+        size = agent._in_bucket(3)
+        ids = ["a", "b", "c"] + ["c"] * (size - 3)
+        plan = db.execute(
+            "EXPLAIN QUERY PLAN " + agent._sql_sent_ids(size),
+            ("u@x.de", "h", "ebay", *ids),
+        ).fetchall()
+        detail = " ".join(row[-1] for row in plan)
+        assert size == 8
+        assert detail.startswith("SEARCH alert_seen"), detail
+        # all four key columns bound (PK, or idx_alert_seen_lookup with its implicit PK suffix)
+        for col in ("user_email=?", "search_hash=?", "src=?", "item_id=?"):
+            assert col in detail, detail
+
+    def test_gc_delete_uses_last_sent_index(self, db):
+        """Test that the GC delete is a range search on last_sent, not a table scan."""
+        plan = db.execute("EXPLAIN QUERY PLAN " + agent._SQL_GC_SEEN, (1,)).fetchall()
+        detail = " ".join(row[-1] for row in plan)
+        assert detail.startswith("SEARCH alert_seen"), detail
+        assert "idx_alert_seen_last_sent" in detail, detail
+
+    def test_gc_removes_old_sent_rows_once_per_day(self, db):
+        """Test that GC drops old mailed rows, keeps unsent ones, and is rate-limited."""
+        old = 1
+        with db:
+            db.execute(
+                "INSERT INTO alert_seen VALUES ('u@x.de', 'h', 'ebay', 'old', ?, ?)",
+                (old, old),
+            )
+            db.execute(
+                "INSERT INTO alert_seen VALUES ('u@x.de', 'h', 'ebay', 'unsent', ?, 0)",
+                (old,),
+            )
+        assert agent.maybe_gc_alert_seen(db) == 1
+        remaining = [r[0] for r in db.execute("SELECT item_id FROM alert_seen")]
+        assert remaining == ["unsent"]
+        with db:
+            db.execute(
+                "INSERT INTO alert_seen VALUES ('u@x.de', 'h', 'ebay', 'old2', ?, ?)",
+                (old, old),
+            )
+        assert (
+            agent.maybe_gc_alert_seen(db) == 0
+        ), "Second run on the same day is skipped"
+
+    def test_gc_returns_free_pages(self, db):
+        """Test that fresh DBs use incremental auto_vacuum and GC hands pages back."""
+        assert db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        with db:
+            db.executemany(
+                "INSERT INTO alert_seen VALUES ('u@x.de', 'h', 'ebay', ?, 1, 1)",
+                [("x" * 200 + str(i),) for i in range(2000)],
+            )
+        assert agent.maybe_gc_alert_seen(db) == 2000
+        assert db.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+    def test_all_sent_skips_write(self, db):
+        """Test that a poll with nothing new does not write to the DB."""
+        items = [{"id": "a"}, {"id": "b"}]
+        agent.mark_sent(
+            "u@x.de", "h", "ebay", agent.filter_new("u@x.de", "h", "ebay", items)
+        )
+        before = db.total_changes
+        assert agent.filter_new("u@x.de", "h", "ebay", items) == []
+        assert db.total_changes == before, "No insert/update expected"
+        assert not db.in_transaction
+
+    def test_many_items_chunked(self, db, monkeypatch):
+        """Test that the sent-id lookup works across several IN (...) chunks."""
+        monkeypatch.setattr(agent, "_IN_CHUNK", 3)
+        items = [{"id": str(i)} for i in range(10)]
+        agent.mark_sent(
+            "u@x.de", "h", "ebay", agent.filter_new("u@x.de", "h", "ebay", items[:7])
+        )
+        assert _ids(agent.filter_new("u@x.de", "h", "ebay", items)) == ["7", "8", "9"]
+
+    def test_sent_lookup_pads_in_list(self, db):
+        """Test that IN lists are padded to a few fixed sizes without changing the result."""
+        assert [agent._in_bucket(n) for n in (1, 8, 9, 100, 500)] == [
+            8,
+            8,
+            16,
+            128,
+            500,
+        ]
+        items = [{"id": str(i)} for i in range(11)]
+        agent.mark_sent("u@x.de", "h", "ebay", items[:5])
+        assert _ids(agent.filter_new("u@x.de", "h", "ebay", items)) == [
+            str(i) for i in range(5, 11)
+        ]
+
+    def test_load_alerts_uses_active_index(self, db):
+        """Test that the active-alert query searches an is_active index, not the table."""
+        plan = db.execute("EXPLAIN QUERY PLAN " + agent._SQL_LOAD_ALERTS).fetchall()
+        detail = " ".join(row[-1] for row in plan)
+        assert detail.startswith("SEARCH search_alerts USING INDEX"), detail
+        assert "is_active=?" in detail
+
+    def test_migrations_keep_shared_indexes(self, db):
+        """Test that indexes also created by init_db.py/database.py are never dropped."""
+        names = {
+            r[0]
+            for r in db.execute("SELECT name FROM sqlite_master WHERE type='index'")
+        }
+        assert {"idx_alerts_active", "idx_search_alerts_active_email"} <= names
+
+
+def _app_make_search_hash():
+    """Load app.py::_make_search_hash from source without importing the Flask app."""
+    import ast
+    import hashlib
+    import json
+    from typing import List
+
+    source = (Path(__file__).parent.parent / "app.py").read_text(encoding="utf-8")
+    (func,) = [
+        node
+        for node in ast.parse(source).body
+        if isinstance(node, ast.FunctionDef) and node.name == "_make_search_hash"
+    ]
+    namespace = {"hashlib": hashlib, "json": json, "List": List}
+    exec(compile(ast.Module(body=[func], type_ignores=[]), "app.py", "exec"), namespace)
+    return namespace["_make_search_hash"]
+
+
+@pytest.mark.parametrize(
+    "terms, filters",
+    [
+        (["iPhone 13 ", "Größe"], {"price_max": "100", "conditions": ["USED", "NEW"]}),
+        (["iphone", " ", ""], {}),
+        (
+            ["„Zitat“ & <b>"],
+            {
+                "price_min": None,
+                "price_max": "",
+                "sort": "price_asc",
+                "conditions": None,
+            },
+        ),
+        (
+            ["a", "b"],
+            {
+                "price_min": "5",
+                "price_max": "50",
+                "sort": "newest",
+                "conditions": ["NEW"],
+            },
+        ),
+    ],
+)
+def test_search_hash_matches_app(terms, filters):
+    """The hash must stay byte-identical to app.py's _make_search_hash."""
+    assert agent.make_search_hash(terms, filters) == _app_make_search_hash()(
+        terms, filters
+    )
+
+
+def test_load_alerts_backfills_search_hash(db):
+    """Alerts created without a hash get it computed once and stored."""
+    with db:
+        db.execute(
+            "INSERT INTO search_alerts (user_email, terms_json, filters_json) VALUES (?, ?, ?)",
+            ("u@x.de", '["iphone"]', '{"price_max": "100"}'),
+        )
+    (alert,) = agent.load_alerts()
+    stored = db.execute("SELECT search_hash FROM search_alerts").fetchone()[0]
+    assert (
+        stored
+        == alert["search_hash"]
+        == agent.make_search_hash(["iphone"], alert["filters"])
+    )
+
+
+def test_load_alerts_reuses_parsed_json(db, monkeypatch):
+    """Unchanged alerts are not JSON-decoded again on the next run."""
+    with db:
+        db.execute(
+            "INSERT INTO search_alerts (user_email, terms_json, filters_json) VALUES (?, ?, ?)",
+            ("u@x.de", '["ipad"]', '{"sort": "newly"}'),
+        )
+    agent._parse_alert_json.cache_clear()
+    first = agent.load_alerts()
+    monkeypatch.setattr(agent, "_json_loads", None)  # a second parse would fail
+    second = agent.load_alerts()
+    assert second[0]["terms"] == first[0]["terms"] == ["ipad"]
+    assert second[0]["filters"]["sort"] == "newly"
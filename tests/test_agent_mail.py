@@ -0,0 +1,295 @@
+# tests/test_agent_mail.py
+"""
+Unit tests for the SMTP path in agent.py.
+
+smtplib.SMTP is replaced by an in-memory fake; no network access needed.
+"""
+
+import email
+import json
+import smtplib
+from email import policy
+
+import pytest
+
+import agent
+
+SETTINGS = {
+    "provider": "smtp",
+    "host": "mail.example",
+    "port": 587,
+    "user": "u",
+    "password": "p",
+    "from": "alerts@example.de",
+    "use_tls": False,
+    "use_ssl": False,
+}
+
+
+class FakeSMTP:
+    """Records connections and messages; can drop the connection once."""
+
+    instances = []
+
+    def __init__(self, host, port, timeout=None):
+        self.sent = []
+        self.drop_next = False
+        FakeSMTP.instances.append(self)
+
+    def login(self, user, pwd):
+        pass
+
+    def sendmail(self, from_addr, to_addrs, raw, mail_options=()):
+        if self.drop_next:
+            raise smtplib.SMTPServerDisconnected("gone")
+        self.sent.append((from_addr, to_addrs, raw, tuple(mail_options)))
+
+    def noop(self):
+        if self.drop_next:
+            raise smtplib.SMTPServerDisconnected("gone")
+        return (250, b"OK")
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.quit()
+
+
+@pytest.fixture
+def fake_smtp(monkeypatch):
+    FakeSMTP.instances = []
+    monkeypatch.setattr(agent.smtplib, "SMTP", FakeSMTP)
+    return FakeSMTP
+
+
+class TestSMTP:
+    """Test suite for build_raw_mail / SMTPSession."""
+
+    def test_raw_mail_roundtrip(self):
+        """Test that the pre-serialized mail parses back to subject and HTML body."""
+        raw = agent.build_raw_mail(
+            "a@b.de", ["c@d.de"], "Neue Treffer für 'iphone'", "<p>Grüße</p>"
+        )
+        msg = email.message_from_bytes(raw, policy=policy.default)
+        assert msg["Subject"] == "Neue Treffer für 'iphone'"
+        assert msg.get_content_type() == "text/html"
+        assert msg.get_content().strip() == "<p>Grüße</p>"
+
+    def test_raw_mail_non_ascii_addresses(self):
+        """Test that non-ASCII display names are RFC 2047 encoded and parse back intact."""
+        raw = agent.build_raw_mail(
+            "Bücher-Alarm <alerts@x.de>", ["jörg@b.de"], "s", "<p/>"
+        )
+        head = raw.split(b"\r\n\r\n", 1)[0]
+        assert b"=?utf-8?" in head
+        msg = email.message_from_bytes(raw, policy=policy.default)
+        assert msg["From"].addresses[0].display_name == "Bücher-Alarm"
+        assert msg["From"].addresses[0].addr_spec == "alerts@x.de"
+        assert "@x.de>" not in msg["Message-ID"].split("@")[0]
+
+    def test_non_ascii_sender_name(self, fake_smtp):
+        """Test that a non-ASCII From name is sent with the bare address as envelope sender."""
+        settings = {**SETTINGS, "from": "Bücher-Alarm <alerts@x.de>"}
+        assert agent.send_mail(settings, ["c@d.de"], "s", "<p/>")
+        from_addr, to_addrs, _, opts = fake_smtp.instances[0].sent[0]
+        assert (from_addr, to_addrs, opts) == ("alerts@x.de", ["c@d.de"], ())
+
+    def test_non_ascii_recipient_uses_smtputf8(self, fake_smtp):
+        """Test that a non-ASCII address is sent with SMTPUTF8 instead of raising."""
+        assert agent.send_mail(SETTINGS, ["jörg@b.de"], "s", "<p/>")
+        assert fake_smtp.instances[0].sent[0][3] == ("SMTPUTF8",)
+
+    def test_unbuildable_mail_fails_only_that_mail(self, fake_smtp, monkeypatch):
+        """Test that an error while building the message returns False instead of raising."""
+
+        def broken(*args):
+            raise UnicodeEncodeError("ascii", "ö", 0, 1, "boom")
+
+        monkeypatch.setattr(agent, "build_raw_mail", broken)
+        assert agent.send_mail(SETTINGS, ["c@d.de"], "s", "<p/>") is False
+
+    def test_session_reuses_connection(self, fake_smtp):
+        """Test that several mails in one session use one connection."""
+        with agent.SMTPSession(SETTINGS) as smtp:
+            assert agent.send_mail(SETTINGS, ["x@y.de"], "s1", "<p>1</p>", smtp=smtp)
+            assert agent.send_mail(SETTINGS, ["z@y.de"], "s2", "<p>2</p>", smtp=smtp)
+        assert len(fake_smtp.instances) == 1
+        assert [m[1] for m in fake_smtp.instances[0].sent] == [["x@y.de"], ["z@y.de"]]
+
+    def test_session_reconnects_after_disconnect(self, fake_smtp):
+        """Test that a dropped connection is reopened once."""
+        with agent.SMTPSession(SETTINGS) as smtp:
+            assert agent.send_mail(SETTINGS, ["x@y.de"], "s1", "<p>1</p>", smtp=smtp)
+            fake_smtp.instances[0].drop_next = True
+            assert agent.send_mail(SETTINGS, ["x@y.de"], "s2", "<p>2</p>", smtp=smtp)
+        assert len(fake_smtp.instances) == 2
+        assert len(fake_smtp.instances[1].sent) == 1
+
+    def test_session_is_lazy(self, fake_smtp):
+        """Test that an unused session never connects."""
+        with agent.SMTPSession(SETTINGS):
+            pass
+        assert fake_smtp.instances == []
+
+    def test_session_recycles_after_max_messages(self, fake_smtp, monkeypatch):
+        """Test that the connection is renewed after SMTP_MAX_MSGS_PER_CONN mails."""
+        monkeypatch.setattr(agent, "SMTP_MAX_MSGS_PER_CONN", 2)
+        with agent.SMTPSession(SETTINGS) as smtp:
+            for i in range(5):
+                assert agent.send_mail(SETTINGS, ["x@y.de"], f"s{i}", "<p/>", smtp=smtp)
+        assert [len(c.sent) for c in fake_smtp.instances] == [2, 2, 1]
+
+    def test_session_probes_idle_connection(self, fake_smtp, monkeypatch):
+        """Test that an idle connection failing NOOP is replaced before sending."""
+        monkeypatch.setattr(agent.SMTPSession, "IDLE_PROBE", 0.0)
+        with agent.SMTPSession(SETTINGS) as smtp:
+            assert agent.send_mail(SETTINGS, ["x@y.de"], "s1", "<p/>", smtp=smtp)
+            fake_smtp.instances[0].drop_next = True
+            assert agent.send_mail(SETTINGS, ["x@y.de"], "s2", "<p/>", smtp=smtp)
+        assert [len(c.sent) for c in fake_smtp.instances] == [1, 1]
+
+
+class TestDigest:
+    """Test suite for the per-recipient digest mail."""
+
+    def test_item_limit_spans_all_sections(self, monkeypatch):
+        """Test that NOTIFY_MAX_ITEMS_PER_MAIL caps the whole digest, not each section."""
+        monkeypatch.setattr(agent, "NOTIFY_MAX_ITEMS_PER_MAIL", 3)
+        items = lambda p: [
+            {"id": f"{p}{i}", "title": f"{p}-item-{i}"} for i in range(2)
+        ]
+        html = agent.render_digest_html(
+            "t", [("ipad", items("a")), ("<mac>", items("b")), ("pc", items("c"))]
+        )
+        assert html.count("-item-") == 3
+        assert "&lt;mac&gt;" in html and ">pc<" not in html
+        assert "+ 3 weitere Treffer" in html
+
+
+class TestPostmarkBatch:
+    """Test suite for send_mail_postmark_batch."""
+
+    @pytest.fixture
+    def posts(self, monkeypatch, fake_response):
+        """Stub the HTTP session; answer every message with ErrorCode 0 except 'bad@'."""
+        sent = []
+
+        def fake_post(url, data=None, **kwargs):
+            batch = json.loads(data)
+            sent.append((url, [m["To"] for m in batch]))
+            answers = [
+                {
+                    "ErrorCode": 300 if m["To"].startswith("bad@") else 0,
+                    "MessageID": "m",
+                }
+                for m in batch
+            ]
+            return fake_response(json.dumps(answers).encode())
+
+        monkeypatch.setattr(agent._http, "post", fake_post)
+        return sent
+
+    @pytest.fixture
+    def respond(self, monkeypatch, fake_response):
+        """Answer every batch request with the given raw body."""
+        return lambda body: monkeypatch.setattr(
+            agent._http, "post", lambda url, **kwargs: fake_response(body)
+        )
+
+    @pytest.mark.parametrize(
+        "body",
+        [
+            b'{"ErrorCode": 0, "Message": "OK"}',
+            b"not json",
+            b"",
+        ],
+    )
+    def test_non_list_response_counts_as_unsent(self, respond, body):
+        """Test that a 2xx body without per-message results marks nothing as sent."""
+        respond(body)
+        msgs = [("a@x.de", "s", "<p/>"), ("b@x.de", "s", "<p/>")]
+        assert agent.send_mail_postmark_batch("key", "from@x.de", msgs) == [
+            False,
+            False,
+        ]
+
+    def test_short_result_list_leaves_tail_unsent(self, respond):
+        """Test that only confirmed entries count; the unmatched tail is unsent."""
+        respond(b'[{"ErrorCode": 0, "MessageID": "m"}, "junk"]')
+        msgs = [
+            ("a@x.de", "s", "<p/>"),
+            ("b@x.de", "s", "<p/>"),
+            ("c@x.de", "s", "<p/>"),
+        ]
+        assert agent.send_mail_postmark_batch("key", "from@x.de", msgs) == [
+            True,
+            False,
+            False,
+        ]
+
+    def test_http_error_marks_all_failed(self, monkeypatch):
+        """Test that a rejected request reports every message of the chunk as not sent."""
+
+        def fail(url, **kwargs):
+            raise ConnectionError("down")
+
+        monkeypatch.setattr(agent._http, "post", fail)
+        assert agent.send_mail_postmark_batch(
+            "key", "f@x.de", [("a@x.de", "s", "<p/>")]
+        ) == [False]
+
+    def test_results_per_message_and_chunking(self, posts, monkeypatch):
+        """Test that each message gets its own result and requests are chunked."""
+        monkeypatch.setattr(agent, "POSTMARK_BATCH_MAX", 2)
+        msgs = [
+            ("a@x.de", "s", "<p/>"),
+            ("bad@x.de", "s", "<p/>"),
+            ("c@x.de", "s", "<p/>"),
+        ]
+        assert agent.send_mail_postmark_batch("key", "from@x.de", msgs) == [
+            True,
+            False,
+            True,
+        ]
+        assert [to for _, to in posts] == [["a@x.de", "bad@x.de"], ["c@x.de"]]
+        assert all(url.endswith("/email/batch") for url, _ in posts)
+
+
+class TestMailSettings:
+    """Test suite for get_mail_settings."""
+
+    def test_reads_env_set_after_import(self, monkeypatch):
+        """Test that settings loaded after import (e.g. by load_dotenv in app.py) are used."""
+        for name in (
+            "POSTMARK_API_TOKEN",
+            "POSTMARK_SERVER_TOKEN",
+            "POSTMARK_TOKEN",
+            "FROM_EMAIL",
+            "EMAIL_FROM",
+            "POSTMARK_FROM",
+            "EMAIL_PROVIDER",
+        ):
+            monkeypatch.delenv(name, raising=False)
+        monkeypatch.setenv("SMTP_HOST", "smtp.late.example")
+        monkeypatch.setenv("SMTP_PORT", "2525")
+        monkeypatch.setenv("SMTP_USER", "late-user")
+        monkeypatch.setenv("SMTP_USE_TLS", "0")
+        agent.get_mail_settings.cache_clear()
+        try:
+            settings = agent.get_mail_settings()
+            assert settings["provider"] == "smtp"
+            assert (settings["host"], settings["port"], settings["user"]) == (
+                "smtp.late.example",
+                2525,
+                "late-user",
+            )
+            assert settings["from"] == "late-user" and settings["use_tls"] is False
+        finally:
+            agent.get_mail_settings.cache_clear()
@@ -0,0 +1,127 @@
+# tests/test_agent_run.py
+"""
+Unit tests for run_agent_once in agent.py.
+
+ebay_search and send_mail_batch are replaced by stubs; each test runs against a fresh
+SQLite file in a temp directory, no network access needed.
+"""
+
+import json
+
+import pytest
+
+import agent
+
+
+@pytest.fixture(autouse=True)
+def run_env(monkeypatch):
+    """Digest mode on, no pilot whitelist, no Telegram users."""
+    monkeypatch.setattr(agent, "PILOT_EMAILS", set())
+    monkeypatch.setattr(agent, "ALERT_DIGEST", True)
+    monkeypatch.setattr(agent, "load_telegram_targets", lambda: {})
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    """Collect sent mails instead of delivering them; outbox.ok controls the result."""
+
+    class Outbox(list):
+        ok = True
+
+    sent = Outbox()
+
+    def fake_send(settings, messages, smtp=None):
+        sent.extend(messages)
+        return [sent.ok] * len(messages)
+
+    monkeypatch.setattr(agent, "send_mail_batch", fake_send)
+    return sent
+
+
+def _add_alert(db, email, terms, filters=None, per_page=20):
+    with db:
+        cur = db.execute(
+            "INSERT INTO search_alerts (user_email, terms_json, filters_json, per_page) VALUES (?, ?, ?, ?)",
+            (email, json.dumps(terms), json.dumps(filters or {}), per_page),
+        )
+    return cur.lastrowid
+
+
+class TestDigestRun:
+    """Test suite for the digest path of run_agent_once."""
+
+    def test_one_digest_per_recipient(self, db, searches, outbox):
+        """Test that all alerts of a recipient end up in a single mail."""
+        _add_alert(db, "u@x.de", ["iphone"])
+        _add_alert(db, "v@x.de", ["ipad"])
+        _add_alert(db, "u@x.de", ["macbook"])
+        agent.run_agent_once()
+        assert sorted(to for to, _, _ in outbox) == ["u@x.de", "v@x.de"]
+        subject = next(subj for to, subj, _ in outbox if to == "u@x.de")
+        assert "2 Suchen" in subject
+
+    def test_second_run_sends_nothing(self, db, searches, outbox):
+        """Test that mailed items are marked and not sent again."""
+        _add_alert(db, "u@x.de", ["iphone"])
+        _add_alert(db, "u@x.de", ["macbook"])
+        agent.run_agent_once()
+        assert len(outbox) == 1
+        outbox.clear()
+        agent.run_agent_once()
+        assert outbox == []
+
+    def test_failed_send_leaves_items_unmarked(self, db, searches, outbox):
+        """Test that items of an undelivered digest are offered again."""
+        _add_alert(db, "u@x.de", ["iphone"])
+        _add_alert(db, "u@x.de", ["macbook"])
+        outbox.ok = False
+        agent.run_agent_once()
+        sent = db.execute(
+            "SELECT COUNT(*) FROM alert_seen WHERE last_sent > 0"
+        ).fetchone()[0]
+        assert sent == 0, "Nothing may be marked as sent after a failed delivery"
+        outbox.clear()
+        outbox.ok = True
+        agent.run_agent_once()
+        assert len(outbox) == 1
+
+    def test_last_run_ts_for_every_grouped_alert(self, db, searches, outbox):
+        """Test that every alert of a digest gets last_run_ts, not just the last one."""
+        ids = [
+            _add_alert(db, "u@x.de", ["iphone"]),
+            _add_alert(db, "u@x.de", ["macbook"]),
+        ]
+        agent.run_agent_once()
+        rows = dict(db.execute("SELECT id, last_run_ts FROM search_alerts"))
+        assert all(rows[i] > 0 for i in ids)
+
+
+class TestSearchGrouping:
+    """Test suite for sharing one search between alerts with the same search_hash."""
+
+    def test_same_search_runs_once_with_max_per_page(self, db, searches, outbox):
+        """Test that identical alerts of different users trigger one search with the largest per_page."""
+        _add_alert(db, "u@x.de", ["iphone"], {"price_max": "100"}, per_page=10)
+        _add_alert(db, "v@x.de", ["iphone"], {"price_max": "100"}, per_page=40)
+        agent.run_agent_once()
+        assert searches == [("iphone", 40)]
+        assert sorted(to for to, _, _ in outbox) == ["u@x.de", "v@x.de"]
+
+
+class TestLogging:
+    """Test suite for the 'agent' logger setup."""
+
+    def test_import_leaves_logging_to_the_host(self):
+        """Test that importing agent installs no handlers and keeps propagation."""
+        assert agent.logger.name == "agent"
+        assert agent.logger.propagate
+        assert agent.logger.handlers == []
+
+    def test_buffer_flushed_when_run_fails(self, monkeypatch):
+        """Test that buffered lines are written even if the run raises."""
+        flushed = []
+        monkeypatch.setattr(agent, "_flush_logs", lambda: flushed.append(True))
+        monkeypatch.setattr(agent, "init_db_if_needed", lambda: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            agent.run_agent_once()
+        assert flushed == [True]
@@ -0,0 +1,112 @@
+# tests/test_agent_search.py
+"""
+Unit tests for the eBay search helpers in agent.py.
+
+ebay_search is replaced by a stub; no network access needed.
+"""
+
+import pytest
+
+import agent
+
+
+class TestSearchMemo:
+    """Test suite for the per-run search memo in submit_terms."""
+
+    def test_identical_searches_share_one_call(self, searches):
+        """Test that alerts with the same term and filters reuse one request."""
+        memo = {}
+        f1 = agent.submit_terms(["iPhone"], 10, {"sort": "best"}, memo)
+        f2 = agent.submit_terms([" iphone "], 10, {"sort": "best"}, memo)
+        assert agent.collect_items(f1) == agent.collect_items(f2)
+        assert len(searches) == 1
+
+    def test_different_filters_are_separate(self, searches):
+        """Test that a different price filter is not served from the memo."""
+        memo = {}
+        agent.collect_items(agent.submit_terms(["iphone"], 10, {}, memo))
+        agent.collect_items(
+            agent.submit_terms(["iphone"], 10, {"price_max": "100"}, memo)
+        )
+        assert len(searches) == 2
+
+    def test_without_memo_every_call_runs(self, searches):
+        """Test that callers without a memo keep the uncached behaviour."""
+        agent.collect_items(agent.submit_terms(["a", "a"], 10, {}))
+        assert [term for term, _ in searches] == ["a", "a"]
+
+
+class TestFilterAndSort:
+    """Test suite for _build_ebay_filter / _map_sort."""
+
+    def test_no_filter(self):
+        assert agent._build_ebay_filter("", "", []) is None
+
+    def test_price_and_conditions(self):
+        filt = agent._build_ebay_filter("10", "", ["new", " used "])
+        assert (
+            filt
+            == f"price:[10..],priceCurrency:{agent.EBAY_CURRENCY},conditions:{{NEW,USED}}"
+        )
+
+    def test_sort_mapping(self):
+        assert agent._map_sort("price_asc") == "price"
+        assert agent._map_sort("best") is None
+        assert agent._map_sort("unknown") is None
+
+
+class TestRateLimiter:
+    """Test suite for _RateLimiter."""
+
+    def test_spaces_calls(self, monkeypatch):
+        """Test that calls beyond the rate are delayed by the interval."""
+        slept = []
+        monkeypatch.setattr(agent.time, "sleep", slept.append)
+        limiter = agent._RateLimiter(10)
+        for _ in range(3):
+            limiter.wait()
+        assert len(slept) == 2
+        assert all(0 < s <= 0.2 + 1e-6 for s in slept)
+
+    def test_disabled(self, monkeypatch):
+        """Test that rps=0 never sleeps."""
+        monkeypatch.setattr(agent.time, "sleep", lambda s: pytest.fail("slept"))
+        limiter = agent._RateLimiter(0)
+        for _ in range(5):
+            limiter.wait()
+
+
+class TestEmptyCache:
+    """Test suite for the negative cache of searches without results."""
+
+    @pytest.fixture
+    def http(self, monkeypatch, fake_response):
+        """Stub the HTTP session; responses come from the returned list."""
+        bodies, hits = [], []
+
+        def fake_get(url, **kwargs):
+            hits.append(kwargs["params"]["q"])
+            return fake_response(bodies.pop(0) if bodies else b"{}")
+
+        monkeypatch.setattr(agent, "ebay_get_token", lambda: "tok")
+        monkeypatch.setattr(agent._http, "get", fake_get)
+        monkeypatch.setattr(agent, "_EMPTY_SEEN", {})
+        monkeypatch.setattr(agent, "_EBAY_LIMITER", agent._RateLimiter(0))
+        return bodies, hits
+
+    def test_empty_search_is_skipped_within_ttl(self, http):
+        """Test that a search without hits is not repeated, with any limit."""
+        _, hits = http
+        assert agent.ebay_search("nix", 10, 0, "", "", [], "best") == []
+        assert agent.ebay_search("NIX", 30, 0, "", "", [], "best") == []
+        assert hits == ["nix"]
+
+    def test_other_filters_and_expiry_search_again(self, http, monkeypatch):
+        """Test that the cache is per filter and expires after EBAY_EMPTY_TTL."""
+        bodies, hits = http
+        agent.ebay_search("nix", 10, 0, "", "", [], "best")
+        agent.ebay_search("nix", 10, 0, "", "100", [], "best")
+        monkeypatch.setattr(agent, "EBAY_EMPTY_TTL", 0)
+        bodies.append(b'{"itemSummaries": [{"itemId": "1"}]}')
+        assert len(agent.ebay_search("nix", 10, 0, "", "", [], "best")) == 1
+        assert hits == ["nix", "nix", "nix"]
@@ -0,0 +1,100 @@
+# tests/test_lock.py
+"""
+Unit tests for lock.py.
+
+The O_EXCL lockfile fallback is forced via HAVE_FCNTL=False; every test uses its own
+lockfile in a temp directory.
+"""
+
+import os
+
+import pytest
+
+import lock
+
+
+@pytest.fixture
+def lockfile(tmp_path, monkeypatch):
+    """Use a temp lockfile and the O_EXCL fallback; never actually sleep."""
+    path = str(tmp_path / "agent.lock")
+    monkeypatch.setattr(lock, "LOCK_PATH", path)
+    monkeypatch.setattr(lock, "HAVE_FCNTL", False)
+    monkeypatch.setattr(lock.time, "sleep", lambda s: None)
+    return path
+
+
+def _write(path, token, age=0):
+    with open(path, "w") as f:
+        f.write(token)
+    mtime = lock.time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+class TestLockfileFallback:
+    """Test suite for the O_EXCL lockfile used without fcntl."""
+
+    def test_acquire_and_release(self, lockfile):
+        """Test that the lockfile exists while held and is removed afterwards."""
+        with lock.agent_lock(timeout=1):
+            assert os.path.exists(lockfile)
+        assert not os.path.exists(lockfile)
+
+    def test_held_lock_times_out(self, lockfile):
+        """Test that a fresh foreign lockfile blocks and is left alone."""
+        _write(lockfile, "other")
+        with pytest.raises(TimeoutError):
+            with lock.agent_lock(timeout=-1):
+                pass
+        assert lock._read_token() == "other"
+
+    def test_stale_lock_is_taken_over(self, lockfile):
+        """Test that a lockfile older than STALE_AFTER is broken and replaced."""
+        _write(lockfile, "dead", age=lock.STALE_AFTER + 10)
+        with lock.agent_lock(timeout=1):
+            assert lock._read_token() != "dead"
+        assert not os.path.exists(lockfile + ".break")
+
+    def test_release_keeps_foreign_lockfile(self, lockfile):
+        """Test that releasing never deletes a lockfile that belongs to someone else."""
+        with lock.agent_lock(timeout=1):
+            _write(lockfile, "other")
+        assert lock._read_token() == "other"
+
+    def test_only_one_breaker_at_a_time(self, lockfile):
+        """Test that a stale lockfile is not removed while another process is breaking it."""
+        _write(lockfile, "dead", age=lock.STALE_AFTER + 10)
+        _write(lockfile + ".break", "123")
+        lock._break_if_stale()
+        assert lock._read_token() == "dead"
+
+    def test_abandoned_break_file_is_cleared(self, lockfile):
+        """Test that the side file of a crashed breaker does not block breaking forever."""
+        _write(lockfile, "dead", age=lock.STALE_AFTER + 10)
+        _write(lockfile + ".break", "123", age=lock.BREAK_STALE_AFTER + 10)
+        lock._break_if_stale()
+        lock._break_if_stale()
+        assert not os.path.exists(lockfile)
+
+    def test_breaker_rechecks_after_claiming(self, lockfile, monkeypatch):
+        """Test that a lockfile refreshed before the claim is kept."""
+        _write(lockfile, "dead", age=lock.STALE_AFTER + 10)
+        create = lock._try_create
+
+        def refresh_then_claim(token, path=None):
+            # another run breaks and re-creates the lock before we get the side file
+            _write(lockfile, "fresh")
+            return create(token, path)
+
+        monkeypatch.setattr(lock, "_try_create", refresh_then_claim)
+        lock._break_if_stale()
+        assert lock._read_token() == "fresh"
+
+
+@pytest.mark.skipif(not lock.HAVE_FCNTL, reason="needs fcntl")
+def test_fcntl_lock(tmp_path, monkeypatch):
+    """The fcntl path acquires and releases without leaving a lock held."""
+    monkeypatch.setattr(lock, "LOCK_PATH", str(tmp_path / "agent.lock"))
+    with lock.agent_lock(timeout=1):
+        pass
+    with lock.agent_lock(timeout=1):
+        pass